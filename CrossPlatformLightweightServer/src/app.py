@@ -1,16 +1,23 @@
 '''
 Application entry point.
 
+Opens the GUI, or transcribes from the command line if given any arguments
+(see `view.cli`). Each way only imports what it needs, so that scripted runs
+never load the GUI.
+
 Project WISE -- Wearable-ML
 Qianlang Chen and Kevin Song
 M 05/03/21
 '''
 
-from model import audio_transcriber
-from view import main_gui
+import sys
 
 def start():
     # audio_transcriber.start('wearable-ml-ff8f2f105b71.json')
+    if len(sys.argv) > 1:
+        from view import cli
+        sys.exit(cli.main())
+    from view import main_gui
     main_gui.start()
 
 if __name__ == '__main__':
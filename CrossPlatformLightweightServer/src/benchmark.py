@@ -0,0 +1,158 @@
+'''
+Measures how fast the transcriber gets audios transcribed.
+
+Runs `audio_transcriber.transcribe_all` against a `MockStorage` and a
+`MockSpeech` on made-up recordings (bursts of tones in noise, with pauses) of
+every duration given, and reports the upload throughput, the time until the
+first transcript is stored, the total latency and the time spent writing
+SRTs, so that changes to the transcriber show up as numbers without a
+credential or network. The conditions of the mock services can be set from the
+command line.
+
+Usage: python benchmark.py [--durations 60,600,1800] [--count N]
+                           [--latency S] [--bandwidth B/S] [--delay S]
+                           [--speed X] [--segment-length S]
+                           [--keep-silence] [--json PATH]
+'''
+
+import argparse
+import json
+import math
+from model import (audio_transcriber, metrics, mock_google, transcript_cache,
+                   transcript_index)
+import numpy
+from os import path
+import tempfile
+import time
+import wave
+
+_FRAME_RATE = 16000 # Hz
+_WRITE_LENGTH = 60 # s
+
+def run(duration: float, count: int, segment_length: float,
+        should_skip_silence: bool, storage_options: dict,
+        speech_options: dict) -> dict:
+    '''
+    Transcribes `count` recordings of `duration` seconds at once through mock
+    services made with `storage_options` and `speech_options`, and returns the
+    measurements.
+    '''
+    with tempfile.TemporaryDirectory() as dir_path:
+        # Start with empty caches so that every audio is transcribed
+        transcript_cache.cache_dir_path = path.join(dir_path, 'cache')
+        transcript_index.index_path = path.join(dir_path, 'index.db')
+        audio_paths = [path.join(dir_path, f'{i:04}.wav') for i in range(count)]
+        for i, audio_path in enumerate(audio_paths):
+            _make_audio(audio_path, duration, i)
+        times = {}
+        metrics.reset()
+        
+        def on_progress(audio_path, stage, _):
+            if stage == 'done': times[audio_path] = time.monotonic()
+        
+        with mock_google.MockStorage(**storage_options) as storage:
+            speech = mock_google.MockSpeech(storage, **speech_options)
+            mock_google.use(storage, speech)
+            start_time = time.monotonic()
+            errors = audio_transcriber.transcribe_all(
+                audio_paths, on_progress, segment_length, should_skip_silence)
+            seconds = time.monotonic() - start_time
+        stats = storage.stats
+        upload_seconds = ((stats['last_byte_time'] - stats['first_byte_time'])
+                          if stats['bytes'] else 0) or math.inf
+        return {
+            'duration': duration,
+            'count': count,
+            'wav_bytes': sum(map(path.getsize, audio_paths)),
+            'uploaded_bytes': stats['bytes'],
+            'requests': stats['requests'] + speech.num_requests,
+            'upload_mb_per_second': stats['bytes'] / 2**20 / upload_seconds,
+            'first_result_seconds':
+                min(times.values()) - start_time if times else None,
+            'seconds': seconds,
+            'srt_seconds': metrics.get_histogram('transcriber_stage_seconds',
+                                                 stage='srt')['sum'],
+            'error': '; '.join(map(str, errors.values())) or None,
+        }
+
+def _make_audio(audio_path, duration, seed):
+    # Utterances of 300 ms tones, in noise and with pauses, like speech
+    random = numpy.random.default_rng(seed)
+    num_frames = round(duration * _FRAME_RATE)
+    with wave.open(audio_path, 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(_FRAME_RATE)
+        position = 0
+        while position < num_frames:
+            count = min(_WRITE_LENGTH * _FRAME_RATE, num_frames - position)
+            frames = random.normal(0, 50, count)
+            for start in range(0, count - _FRAME_RATE // 2, _FRAME_RATE):
+                if random.random() < .4: continue # a pause
+                n = numpy.arange(round(.3 * _FRAME_RATE))
+                frequency = random.uniform(150, 2000)
+                frames[start:start + len(n)] += 6000 * numpy.sin(
+                    2 * numpy.pi * frequency * n / _FRAME_RATE)
+            audio.writeframes(frames.astype('<i2').tobytes())
+            position += count
+
+def _parse_bandwidth(text):
+    text = text.strip().upper()
+    units = {'K': 2**10, 'M': 2**20}
+    if text[-1] in units: return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the transcriber on mock Google services.')
+    parser.add_argument(
+        '-d', '--durations', default='60,600,1800',
+        help='comma-separated audio lengths in seconds (default: 60,600,1800)')
+    parser.add_argument('-c', '--count', default=2, type=int,
+                        help='number of audios to transcribe at once '
+                        '(default: 2)')
+    parser.add_argument('-l', '--latency', default=.02, type=float,
+                        help='delay before every storage response in seconds '
+                        '(default: .02)')
+    parser.add_argument('-b', '--bandwidth', default='0',
+                        help='maximum bytes uploaded per second, K or M '
+                        '(default: no cap)')
+    parser.add_argument('-p', '--delay', default=1., type=float,
+                        help='seconds before any transcription is done '
+                        '(default: 1)')
+    parser.add_argument('-x', '--speed', default=30., type=float,
+                        help='seconds of audio transcribed per second '
+                        '(default: 30)')
+    parser.add_argument('-s', '--segment-length', type=float,
+                        default=audio_transcriber._SEGMENT_LENGTH,
+                        help='seconds of audio per segment, or 0 for none '
+                        f'(default: {audio_transcriber._SEGMENT_LENGTH})')
+    parser.add_argument('-k', '--keep-silence', action='store_true',
+                        help='transcribe the silent parts too')
+    parser.add_argument('-j', '--json',
+                        help='also write the results as JSON to this file')
+    args = parser.parse_args(args)
+    storage_options = {
+        'latency': args.latency,
+        'bandwidth': _parse_bandwidth(args.bandwidth),
+    }
+    speech_options = {'delay': args.delay, 'speed': args.speed}
+    print(f'{"duration":>9}{"count":>7}{"WAV MB":>9}{"sent MB":>9}'
+          f'{"MB/s":>8}{"first":>8}{"total":>8}{"SRT ms":>8}  error')
+    results = []
+    for duration in map(float, args.durations.split(',')):
+        x = run(duration, args.count, args.segment_length,
+                not args.keep_silence, storage_options, speech_options)
+        first = x['first_result_seconds']
+        print(f'{duration:>9g}{args.count:>7}{x["wav_bytes"] / 2**20:>9.1f}'
+              f'{x["uploaded_bytes"] / 2**20:>9.1f}'
+              f'{x["upload_mb_per_second"]:>8.2f}'
+              f'{first if first is not None else math.nan:>8.2f}'
+              f'{x["seconds"]:>8.2f}{x["srt_seconds"] * 10**3:>8.1f}'
+              f'  {x["error"] or ""}')
+        results.append(x)
+    if args.json:
+        with open(args.json, 'w') as target:
+            json.dump(results, target, indent=2)
+
+if __name__ == '__main__': main()
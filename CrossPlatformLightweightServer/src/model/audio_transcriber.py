@@ -5,16 +5,34 @@ Requires a JSON credential to authenticate and working Internet. The `start`
 function must be called first with a valid credential before transcribing an
 audio.
 
+Long audios are cut into overlapping segments that are uploaded and
+transcribed concurrently, then joined back into one transcript, since the
+service takes about as long as the audio it is given. Only the parts of the
+audio where `voice_activity` finds speech are sent, compressed losslessly into
+FLAC while being uploaded. The words recognized are kept in `transcript_cache`,
+so transcribing the same audio again takes no time, and are added to
+`transcript_index` to be searched along with all other recordings.
+
+`transcribe_all` transcribes many audios at once, sharing the uploads and the
+polling of the transcriptions. The time every stage takes, the latency of the
+requests and the bytes uploaded are recorded in `metrics`.
+
 Project WISE -- Wearable-ML
 Qianlang Chen and Kevin Song
 M 05/03/21
 '''
 
+from concurrent import futures
 from google.auth.transport import requests
 from google.cloud import speech, storage
 from google.resumable_media.requests import upload
+import math
+from model import (flac_encoder, metrics, transcript_cache, transcript_index,
+                   voice_activity)
+import os
 from os import path
 import time
+import uuid
 import wave
 
 from collections.abc import Callable
@@ -39,78 +57,416 @@ def start(credential_path: str):
     _storage_client = storage.Client.from_service_account_json(credential_path)
     _storage_bucket = _storage_client.bucket(_BUCKET_NAME)
 
-_UPLOAD_URL = ('https://www.googleapis.com/upload/storage/v1/b/'
-               f'{_BUCKET_NAME}/o?uploadType=resumable')
+_UPLOAD_URL_FORMAT = ('%s/upload/storage/v1/b/'
+                      f'{_BUCKET_NAME}/o?uploadType=resumable')
+'''Filled in with the API endpoint of the storage client.'''
+_UPLOAD_CHUNK_SIZE = 2**18 # 256 KB
+_MAX_NUM_UPLOADS = 4
+_MAX_NUM_POLLS = 8
+_READ_NUM_FRAMES = 2**16
 _PROGRESS_INTERVAL = 1 # s
 _ACCESS_URI_FORMAT = f'gs://{_BUCKET_NAME}/%s'
+_LANGUAGE_CODE = 'en-US'
 _MAX_NUM_WORDS_IN_LINE = 12
 _LINE_INTERVAL = 500 # ms
 '''
 Consider a word to be the start of a new line if it starts x milliseconds or
 more after the previous word.
 '''
+_SEGMENT_LENGTH = 5 * 60 # s
+_SEGMENT_OVERLAP = 4 # s
+'''
+Let consecutive segments share x seconds of audio, so that a word cut off at
+the end of one segment is still heard whole in the next one.
+'''
 
 def transcribe(source_audio_path: str, target_srt_path: str,
-               progress_callback: Callable[[str, float]]):
+               progress_callback: Callable[[str, float], None],
+               segment_length: float = _SEGMENT_LENGTH,
+               should_skip_silence=True):
     '''
     Accesses Google to transcribe a WAV file at `source_audio_path` and stores
     the text transcript in SubRip Subtitle (SRT) format at `target_srt_path`.
     
+    Audios longer than `segment_length` seconds are cut into segments of that
+    length, which are transcribed concurrently; pass 0 to transcribe the audio
+    in one piece. With `should_skip_silence`, only the parts with speech are
+    transcribed, and the times in the transcript are those in the whole audio.
+    
     Blocks the thread and reports progress regularly through the
-    `progress_callback`.
+    `progress_callback`. Audios transcribed before with the same settings are
+    not transcribed again.
     '''
-    blob_name = path.basename(source_audio_path)
-    # Upload the audio to Google Cloud Storage (GCS), which is required for
-    # audios longer than 1 minute
-    global _speech_client, _storage_bucket, _storage_client
-    blob = _storage_bucket.blob(blob_name)
-    resumable = upload.ResumableUpload(_UPLOAD_URL, 2**18) # 256 KB chunks
+    job = _Job(source_audio_path, target_srt_path, segment_length,
+               should_skip_silence)
+    
+    def on_progress(_, stage, progress):
+        if stage != 'done': progress_callback(stage, progress)
+    
+    _run([job], on_progress)
+    if job.error: raise job.error
+
+def transcribe_all(source_paths: list[str],
+                   progress_callback: Callable[[str, str, float], None],
+                   segment_length: float = _SEGMENT_LENGTH,
+                   should_skip_silence=True) -> dict[str, Exception]:
+    '''
+    Transcribes many WAV files like `transcribe`, each into an SRT file of the
+    same name next to it. `source_paths` may also name directories, of which
+    all WAV files are transcribed.
+    
+    The segments of all audios share `_MAX_NUM_UPLOADS` uploads in flight, and
+    every transcription runs at the same time, so that the batch takes about
+    as long as its longest audio. Copies of the same audio are transcribed
+    only once, into an SRT next to each. Blocks the thread and reports progress
+    regularly through the `progress_callback`, with the path of each audio
+    first and a last 'done' stage once its transcript is stored. Returns the
+    error of every audio that could not be transcribed, by its path.
+    '''
+    audio_paths = []
+    for source_path in source_paths:
+        if path.isdir(source_path):
+            audio_paths.extend(path.join(source_path, x)
+                               for x in sorted(os.listdir(source_path))
+                               if x.lower().endswith('.wav'))
+        else: audio_paths.append(source_path)
+    audio_paths = list(dict.fromkeys(audio_paths)) # named twice
+    jobs = [
+        _Job(x, path.splitext(x)[0] + '.srt', segment_length,
+             should_skip_silence) for x in audio_paths
+    ]
+    _run(jobs, progress_callback)
+    return {x.source_audio_path: x.error for x in jobs if x.error}
+
+class _Job:
+    '''The transcription of one audio, through all of its stages.'''
+    
+    def __init__(self, source_audio_path: str, target_srt_path: str,
+                 segment_length: float, should_skip_silence: bool):
+        self.source_audio_path = source_audio_path
+        self.target_srt_path = target_srt_path
+        self.segment_length = segment_length
+        self.should_skip_silence = should_skip_silence
+        self.error: Exception = None
+        self.words: list[tuple[str, int, int]] = None
+        self.operations = []
+        self.duplicates: list[_Job] = [] # of the same audio and settings
+        self._cache_key: str = None
+        self._frame_rate: int = None
+        self._speech_map: voice_activity.SpeechMap = None
+        self._segments: list[tuple[int, int]] = []
+        self._blob_names: list[str] = []
+        self._upload_progress: list[float] = []
+        self._uploads: list[futures.Future] = []
+        self._stage_start_time: float = None
+    
+    def prepare(self):
+        '''
+        Looks up the words in the cache, or otherwise finds the speech and
+        plans the segments to transcribe.
+        '''
+        self._stage_start_time = time.monotonic()
+        self._cache_key = transcript_cache.get_key(
+            self.source_audio_path, {
+                'language_code': _LANGUAGE_CODE,
+                'segment_length': self.segment_length,
+                'should_skip_silence': self.should_skip_silence,
+            })
+        self.words = transcript_cache.load(self._cache_key)
+        if self.words is not None: return
+        with wave.open(self.source_audio_path, 'rb') as audio: # read binary
+            if audio.getsampwidth() != 2:
+                raise ValueError('Only 16-bit audio is supported')
+            self._frame_rate = audio.getframerate()
+            num_frames = audio.getnframes()
+        if self.should_skip_silence:
+            parts = voice_activity.find_speech(self.source_audio_path)
+        else: parts = [(0, num_frames)]
+        self._speech_map = voice_activity.SpeechMap(parts, self._frame_rate)
+        if self._speech_map.num_frames == 0:
+            self.words = []
+            return
+        self._segments = _plan_segments(self._speech_map.num_frames,
+                                        self._frame_rate, self.segment_length)
+        # Unique to the job, so that no other job (of the same audio, even from
+        # another run) uploads to or deletes the same blobs
+        blob_prefix = uuid.uuid4().hex
+        self._blob_names = [
+            f'{blob_prefix}-{i:03}.flac' for i in range(len(self._segments))
+        ]
+        self._upload_progress = [0.] * len(self._segments)
+    
+    def start(self, executor: futures.Executor):
+        '''
+        Queues the segments to be uploaded to Google Cloud Storage (GCS),
+        which is required for audios longer than 1 minute, and transcribed as
+        soon as they are uploaded.
+        '''
+        config = speech.RecognitionConfig(
+            enable_word_time_offsets=True,
+            encoding=speech.RecognitionConfig.AudioEncoding.FLAC,
+            language_code=_LANGUAGE_CODE,
+            sample_rate_hertz=self._frame_rate)
+        self._uploads = [
+            executor.submit(_upload_and_recognize, self.source_audio_path,
+                            self._speech_map, segment, blob_name, config,
+                            self._upload_progress, i)
+            for i, (segment, blob_name) in enumerate(
+                zip(self._segments, self._blob_names))
+        ]
+    
+    def advance(self, progress_callback: Callable[[str, str, float], None],
+                polls: dict) -> bool:
+        '''
+        Moves on to the next stage if the current one is over, given the
+        latest `polls` of the operations by their IDs, and returns whether the
+        words are ready.
+        '''
+        if not self.operations:
+            if not all(x.done() for x in self._uploads):
+                progress_callback(
+                    self.source_audio_path, 'upload',
+                    sum(x * n for x, (_, n) in zip(self._upload_progress,
+                                                   self._segments)) /
+                    max(1, sum(n for _, n in self._segments)))
+                return False
+            self.operations = [x.result() for x in self._uploads]
+            self._end_stage('upload')
+            progress_callback(self.source_audio_path, 'upload', 1)
+            return False
+        for poll in (polls[id(x)] for x in self.operations):
+            if isinstance(poll, Exception): raise poll
+        if not all(polls[id(x)] for x in self.operations):
+            progress_callback(
+                self.source_audio_path, 'transcribe',
+                sum(x.metadata.progress_percent
+                    for x in self.operations) * .01 / len(self.operations))
+            return False
+        self._end_stage('transcribe')
+        # Join the transcriptions, at the times in the whole audio
+        words = _merge_segments(
+            [(start_frame * 10**3 // self._frame_rate,
+              _get_words(operation.result()))
+             for (start_frame, _), operation in zip(self._segments,
+                                                    self.operations)],
+            _SEGMENT_OVERLAP * 10**3)
+        self.words = [(word, self._speech_map.to_source_time(start_time),
+                       self._speech_map.to_source_time(end_time))
+                      for word, start_time, end_time in words]
+        self.delete_blobs()
+        transcript_cache.store(self._cache_key, self.words)
+        return True
+    
+    def delete_blobs(self):
+        '''Deletes the uploaded audio to save cloud storage.'''
+        for blob_name in self._blob_names:
+            try:
+                with metrics.timed('transcriber_request_seconds',
+                                   request='delete'):
+                    _storage_bucket.blob(blob_name).delete()
+            except Exception as ex: # not uploaded
+                print('Caught:', ex)
+    
+    def _end_stage(self, stage):
+        # Records how long the stage took and starts timing the next one
+        now = time.monotonic()
+        _record_stage(self.source_audio_path, stage,
+                      now - self._stage_start_time)
+        self._stage_start_time = now
+
+def _run(jobs, progress_callback):
+    # Runs all jobs from a single loop: the uploads share a pool, and every
+    # operation is polled once per round
+    with futures.ThreadPoolExecutor(_MAX_NUM_UPLOADS) as uploader, \
+            futures.ThreadPoolExecutor(_MAX_NUM_POLLS) as poller:
+        pending = []
+        started = {} # by cache key, so that the same audio is sent only once
+        for job in jobs:
+            try:
+                job.prepare()
+                job._end_stage('prepare')
+                if job.words is not None: _finish(job, progress_callback)
+                elif job._cache_key in started:
+                    started[job._cache_key].duplicates.append(job)
+                else:
+                    job.start(uploader)
+                    started[job._cache_key] = job
+                    pending.append(job)
+            except Exception as ex:
+                _fail(job, ex)
+        while pending:
+            operations = [x for job in pending for x in job.operations]
+            polls = dict(zip(map(id, operations), poller.map(_poll,
+                                                             operations)))
+            for job in tuple(pending):
+                try:
+                    if not job.advance(_fan_out(job, progress_callback),
+                                       polls): continue
+                    _finish(job, progress_callback)
+                except Exception as ex:
+                    _fail(job, ex)
+                    job.delete_blobs()
+                _finish_duplicates(job, progress_callback)
+                pending.remove(job)
+            if pending: time.sleep(_PROGRESS_INTERVAL)
+
+def _fan_out(job, progress_callback):
+    # Reports the progress of a job for its duplicates as well
+    def on_progress(_, stage, progress):
+        for x in (job, *job.duplicates):
+            progress_callback(x.source_audio_path, stage, progress)
+    return on_progress
+
+def _finish_duplicates(job, progress_callback):
+    for duplicate in job.duplicates:
+        try:
+            if job.words is None: raise job.error
+            duplicate.words = job.words
+            _finish(duplicate, progress_callback)
+        except Exception as ex:
+            _fail(duplicate, ex)
+
+def _poll(operation):
+    # Checking an operation refreshes its progress
+    start_time = time.monotonic()
+    try:
+        return operation.done()
+    except Exception as ex:
+        metrics.count('transcriber_poll_errors_total')
+        return ex
+    finally:
+        metrics.observe('transcriber_request_seconds',
+                        time.monotonic() - start_time, request='poll')
+
+def _finish(job, progress_callback):
+    with metrics.timed('transcriber_stage_seconds', stage='srt'):
+        _write_srt(job.target_srt_path, job.words)
+    try:
+        with metrics.timed('transcriber_stage_seconds', stage='index'):
+            transcript_index.add(job.source_audio_path, job.words,
+                                 job._cache_key)
+    except Exception as ex: # the transcript is written; only search misses it
+        print('Caught:', ex)
+        metrics.count('transcriber_index_errors_total')
+        metrics.log('index_error', path=job.source_audio_path,
+                    error=f'{type(ex).__name__}: {ex}')
+    metrics.count('transcriber_audios_total', result='done')
+    metrics.log('done', path=job.source_audio_path)
+    progress_callback(job.source_audio_path, 'done', 1)
+
+def _fail(job, error):
+    job.error = error
+    metrics.count('transcriber_audios_total', result='failed')
+    metrics.log('error', path=job.source_audio_path,
+                error=f'{type(error).__name__}: {error}')
+
+def _record_stage(audio_path, stage, seconds):
+    metrics.observe('transcriber_stage_seconds', seconds, stage=stage)
+    metrics.log('stage', path=audio_path, stage=stage,
+                seconds=round(seconds, 4))
+
+def _plan_segments(num_frames, frame_rate, segment_length):
+    if not segment_length or num_frames <= segment_length * frame_rate:
+        return [(0, num_frames)]
+    if segment_length <= 2 * _SEGMENT_OVERLAP:
+        raise ValueError(f'Segments must be longer than {2 * _SEGMENT_OVERLAP} '
+                         f'seconds: {segment_length}')
+    length = round(segment_length * frame_rate)
+    step = length - round(_SEGMENT_OVERLAP * frame_rate)
+    segments = []
+    for start_frame in range(0, num_frames, step):
+        segments.append((start_frame, min(length, num_frames - start_frame)))
+        if start_frame + length >= num_frames: break
+    return segments
+
+def _upload_and_recognize(source_audio_path, speech_map, segment, blob_name,
+                          config, upload_progress, index):
+    # The size of the compressed audio is only known once it is all read, so
+    # the upload ends at the first chunk that comes up short
+    resumable = upload.ResumableUpload(
+        _UPLOAD_URL_FORMAT % _storage_client.api_endpoint, _UPLOAD_CHUNK_SIZE)
     transport = requests.AuthorizedSession(_storage_client._credentials)
-    with open(source_audio_path, 'rb') as audio:
-        resumable.initiate(transport, audio, {'name': blob.name}, 'audio/wav')
-        progress_callback('upload', 0)
+    start_time = time.monotonic()
+    with wave.open(source_audio_path, 'rb') as audio:
+        start_frame, num_frames = segment
+        blocks = _read_frames(audio, speech_map, start_frame, num_frames,
+                              upload_progress, index)
+        stream = flac_encoder.FlacStream(blocks, audio.getframerate(),
+                                         audio.getnchannels(), num_frames)
+        with metrics.timed('transcriber_request_seconds', request='initiate'):
+            resumable.initiate(transport, stream, {'name': blob_name},
+                               'audio/flac', stream_final=False)
         while not resumable.finished:
-            resumable.transmit_next_chunk(transport)
-            progress_callback('upload',
-                              resumable.bytes_uploaded / resumable.total_bytes)
-        progress_callback('upload', 1)
-    # Request an online transcription
-    with wave.open(source_audio_path, 'rb') as audio: # rb for read binary
-        frame_rate = audio.getframerate()
-    config = speech.RecognitionConfig(
-        enable_word_time_offsets=True,
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        language_code='en-US',
-        sample_rate_hertz=frame_rate)
+            # Includes reading and compressing the chunk
+            with metrics.timed('transcriber_request_seconds', request='chunk'):
+                resumable.transmit_next_chunk(transport)
+    seconds = time.monotonic() - start_time
+    metrics.count('transcriber_uploaded_bytes_total', resumable.bytes_uploaded)
+    metrics.observe('transcriber_upload_bytes_per_second',
+                    resumable.bytes_uploaded / (seconds or math.inf),
+                    metrics.BYTES_PER_SECOND_BUCKETS)
+    metrics.log('upload', path=source_audio_path, segment=index,
+                bytes=resumable.bytes_uploaded, seconds=round(seconds, 4))
     audio = speech.RecognitionAudio(uri=_ACCESS_URI_FORMAT % blob_name)
-    operation = _speech_client.long_running_recognize(config=config,
-                                                      audio=audio)
-    while not operation.done():
-        progress_callback('transcribe',
-                          operation.metadata.progress_percent * .01)
-        time.sleep(_PROGRESS_INTERVAL)
-    # Delete the uploaded audio to save cloud storage
-    blob.delete()
-    # Store the transcription
+    with metrics.timed('transcriber_request_seconds', request='recognize'):
+        return _speech_client.long_running_recognize(config=config,
+                                                     audio=audio)
+
+def _read_frames(audio, speech_map, start_frame, num_frames, upload_progress,
+                 index):
+    num_frames_read = 0
+    for frames in speech_map.read(audio, start_frame, num_frames,
+                                  _READ_NUM_FRAMES):
+        yield frames
+        num_frames_read += len(frames)
+        upload_progress[index] = num_frames_read / num_frames
+
+def _get_words(response):
+    # As (word, start time, end time), all times in milliseconds
+    words = []
+    for res in response.results:
+        for word_data in res.alternatives[0].words:
+            words.append((word_data.word,
+                          word_data.start_time.seconds * 10**3 +
+                          word_data.start_time.microseconds // 10**3,
+                          word_data.end_time.seconds * 10**3 +
+                          word_data.end_time.microseconds // 10**3))
+    return words
+
+def _merge_segments(segments, overlap):
+    # Each segment owns its words up to the middle of its overlap with the next
+    # one; a word split by the middle may still be heard in both, so drop the
+    # second copy of a word that overlaps the same word before it
+    words = []
+    for i, (start_time, segment_words) in enumerate(segments):
+        cut_time = start_time + overlap // 2 if i else -math.inf
+        next_cut_time = (segments[i + 1][0] + overlap // 2
+                         if i + 1 < len(segments) else math.inf)
+        for word, word_start_time, word_end_time in segment_words:
+            word_start_time += start_time
+            word_end_time += start_time
+            if not cut_time <= word_start_time < next_cut_time: continue
+            if (words and word.lower() == words[-1][0].lower() and
+                    word_start_time < words[-1][2]):
+                continue
+            words.append((word, word_start_time, word_end_time))
+    return words
+
+def _write_srt(target_srt_path, words):
     line = []
     line_index = 1
     line_start_time = line_end_time = 0 # all in milliseconds
     with open(target_srt_path, 'w') as target:
-        for res in operation.result().results:
-            for word_data in res.alternatives[0].words:
-                word_start_time = (word_data.start_time.seconds * 10**3 +
-                                   word_data.start_time.microseconds // 10**3)
-                word_end_time = (word_data.end_time.seconds * 10**3 +
-                                 word_data.end_time.microseconds // 10**3)
-                if (len(line) == _MAX_NUM_WORDS_IN_LINE or line and
-                        word_start_time - line_end_time >= _LINE_INTERVAL):
-                    _write_line(target, line, line_index, line_start_time,
-                                line_end_time)
-                    line.clear()
-                    line_index += 1
-                    line_start_time = word_start_time
-                line.append(word_data.word)
-                line_end_time = word_end_time
+        for word, word_start_time, word_end_time in words:
+            if (len(line) == _MAX_NUM_WORDS_IN_LINE or line and
+                    word_start_time - line_end_time >= _LINE_INTERVAL):
+                _write_line(target, line, line_index, line_start_time,
+                            line_end_time)
+                line.clear()
+                line_index += 1
+                line_start_time = word_start_time
+            line.append(word)
+            line_end_time = word_end_time
         if line:
             _write_line(target, line, line_index, line_start_time,
                         line_end_time)
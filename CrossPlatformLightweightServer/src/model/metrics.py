@@ -0,0 +1,173 @@
+'''
+Counts and times the work done, to find out where the time goes.
+
+Every measurement has a name and labels, such as the stage of transcribing.
+`count` adds to a counter and `observe` adds a sample to a histogram of fixed
+buckets; both only take a lock and a few additions, so they can be called from
+any thread on every request. `log` writes an event as a JSON line to
+`events_file`, and does nothing unless one is set. `write_text` writes every
+metric in the Prometheus text format, which monitoring can scrape (such as
+through the textfile collector of the node exporter), and `start_export` keeps
+rewriting it while a long run goes on.
+'''
+
+import bisect
+import contextlib
+import json
+import os
+from threading import Event, Lock, Thread
+import time
+from typing import TextIO
+
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60,
+                   120, 300, 600)
+BYTES_PER_SECOND_BUCKETS = tuple(2**x for x in range(10, 27, 2)) # 1 KB-64 MB
+
+_EXPORT_INTERVAL = 15 # s
+
+events_file: TextIO = None
+'''Where `log` writes events, one JSON object per line, if anywhere.'''
+
+_lock = Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}
+'''The buckets, counts per bucket, sum and count of each histogram.'''
+_export_thread: Thread = None
+_should_stop_export = Event()
+
+def count(name: str, amount: float = 1, **labels):
+    '''Adds `amount` to the counter `name` of `labels`.'''
+    key = (name, tuple(sorted(labels.items())))
+    with _lock: _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name: str, value: float, buckets: tuple = SECONDS_BUCKETS,
+            **labels):
+    '''
+    Adds `value` to the histogram `name` of `labels`, which counts the values
+    up to each of `buckets` (the first time it is used decides them).
+    '''
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if not histogram:
+            histogram = _histograms[key] = [buckets, [0] * len(buckets), 0., 0]
+        index = bisect.bisect_left(histogram[0], value)
+        if index < len(histogram[1]): histogram[1][index] += 1
+        histogram[2] += value
+        histogram[3] += 1
+
+@contextlib.contextmanager
+def timed(name: str, **labels):
+    '''Observes the seconds that the `with` block takes, even if it raises.'''
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start_time, **labels)
+
+def log(event: str, **values):
+    '''Writes `values` as a JSON line of `event` to `events_file`, if set.'''
+    if not events_file: return
+    line = json.dumps({'event': event, 'time': round(time.time(), 3), **values})
+    with _lock:
+        events_file.write(line + '\n')
+        events_file.flush()
+
+def get_histogram(name: str, **labels) -> dict:
+    '''
+    Returns the 'sum' and 'count' of the values of a histogram and the number
+    of values up to each of its 'buckets'.
+    '''
+    with _lock:
+        histogram = _histograms.get((name, tuple(sorted(labels.items()))))
+        if not histogram: return {'buckets': {}, 'sum': 0., 'count': 0}
+        buckets, counts, total, num_values = histogram
+        return {
+            'buckets': dict(zip(buckets, _accumulate(counts))),
+            'sum': total,
+            'count': num_values,
+        }
+
+def reset():
+    '''Forgets every measurement.'''
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def format_text() -> str:
+    '''Returns every metric in the Prometheus text format.'''
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, (v[0], list(v[1]), v[2], v[3]))
+                            for k, v in _histograms.items())
+    last_name = None
+    for (name, labels), value in counters:
+        if name != last_name: lines.append(f'# TYPE {name} counter')
+        last_name = name
+        lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+    for (name, labels), (buckets, counts, total, num_values) in histograms:
+        if name != last_name: lines.append(f'# TYPE {name} histogram')
+        last_name = name
+        for bucket, num_up_to in zip(buckets + ('+Inf',),
+                                     _accumulate(counts) + [num_values]):
+            bucket_labels = _format_labels(labels + (('le', bucket),))
+            lines.append(f'{name}_bucket{bucket_labels} {num_up_to}')
+        lines.append(f'{name}_sum{_format_labels(labels)} '
+                     f'{_format_number(total)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {num_values}')
+    return '\n'.join(lines) + '\n'
+
+def write_text(text_path: str):
+    '''
+    Writes every metric to `text_path` in the Prometheus text format, all at
+    once, so that a scraper never reads half of it.
+    '''
+    with open(text_path + '.part', 'w') as target:
+        target.write(format_text())
+    os.replace(text_path + '.part', text_path)
+
+def start_export(text_path: str, interval: float = _EXPORT_INTERVAL):
+    '''
+    Writes the metrics to `text_path` every `interval` seconds, from a
+    background thread, until `stop_export`.
+    '''
+    global _export_thread
+    stop_export()
+    _should_stop_export.clear()
+    
+    def export():
+        while not _should_stop_export.wait(interval):
+            write_text(text_path)
+        write_text(text_path)
+    
+    _export_thread = Thread(target=export, daemon=True)
+    _export_thread.start()
+
+def stop_export():
+    '''Writes the metrics one last time and stops exporting them.'''
+    global _export_thread
+    if not _export_thread: return
+    _should_stop_export.set()
+    _export_thread.join()
+    _export_thread = None
+
+def _accumulate(counts):
+    # Prometheus buckets count every value up to them, not just since the last
+    total = 0
+    accumulated = []
+    for x in counts:
+        total += x
+        accumulated.append(total)
+    return accumulated
+
+def _format_labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+def _escape(value):
+    if not isinstance(value, str): value = _format_number(value)
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _format_number(value):
+    return value if isinstance(value, str) else repr(value)
@@ -0,0 +1,284 @@
+'''
+Stand-ins for the Google Cloud services that `audio_transcriber` uses, which
+run on this computer.
+
+`MockStorage` serves the part of the Cloud Storage JSON API that the
+transcriber calls (resumable uploads and deleting objects) over HTTP on a
+local port, with a latency before every response and a cap on the bandwidth
+shared by all uploads, so that the real storage client and upload code run
+against it unchanged. `MockSpeech` takes the place of a `speech.SpeechClient`:
+it recognizes the audio uploaded to a `MockStorage` after a processing delay
+that grows with the length of the audio, as the service does, and answers
+with canned words. `use` makes the transcriber use both, in place of the
+clients made by `audio_transcriber.start`, so that it can be exercised and
+benchmarked without a credential or network.
+'''
+
+import datetime
+from google.api_core import exceptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import speech, storage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import itertools
+import json
+from model import audio_transcriber
+import re
+import struct
+from threading import Lock, Thread
+import time
+from urllib import parse
+import wave
+
+_WORD_INTERVAL = .6 # s
+_WORD_LENGTH = .3 # s
+_WORD_TEXTS = ('the quick brown fox jumps over the lazy dog while five '
+               'boxing wizards jump quickly').split()
+_READ_CHUNK_SIZE = 2**14
+
+class MockStorage:
+    '''
+    Keeps the objects uploaded to any bucket in `blobs` by their names.
+    
+    `latency` is the delay in seconds before every response, and `bandwidth`
+    caps the bytes received per second across all uploads (0 for no cap).
+    `stats` counts the requests and the bytes received, and when the first
+    and the last of those bytes arrived (by `time.monotonic`).
+    '''
+    
+    def __init__(self, latency=0., bandwidth=0, address='127.0.0.1'):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.address = address
+        self.blobs: dict[str, bytes] = {}
+        self.stats = {
+            'requests': 0,
+            'bytes': 0,
+            'first_byte_time': None,
+            'last_byte_time': None,
+        }
+        self._lock = Lock()
+        self._uploads: dict[str, tuple[str, bytearray]] = {}
+        self._upload_ids = itertools.count()
+        self._link_free_time = 0.
+        self._server: ThreadingHTTPServer = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *_):
+        self.stop()
+    
+    @property
+    def endpoint(self) -> str:
+        '''The URL to reach the mock at, in place of the storage API's.'''
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+    
+    def start(self):
+        '''Starts serving on a background thread, on any free port.'''
+        self._server = ThreadingHTTPServer((self.address, 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.storage = self
+        Thread(target=self._server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def make_client(self) -> storage.Client:
+        '''Returns a storage client that talks to this mock.'''
+        return storage.Client(project='mock',
+                              credentials=AnonymousCredentials(),
+                              client_options={'api_endpoint': self.endpoint})
+    
+    def _count(self, key, amount=1):
+        with self._lock: self.stats[key] += amount
+    
+    def _receive(self, source, num_bytes):
+        # Uploads share the bandwidth, so each chunk waits for the ones queued
+        # before it
+        content = bytearray()
+        while len(content) < num_bytes:
+            chunk = source.read(min(_READ_CHUNK_SIZE, num_bytes - len(content)))
+            if not chunk: break
+            if self.bandwidth:
+                with self._lock:
+                    now = time.monotonic()
+                    self._link_free_time = (max(self._link_free_time, now) +
+                                            len(chunk) / self.bandwidth)
+                    delay = self._link_free_time - now
+                time.sleep(delay)
+            content += chunk
+            with self._lock:
+                now = time.monotonic()
+                self.stats['bytes'] += len(chunk)
+                if self.stats['first_byte_time'] is None:
+                    self.stats['first_byte_time'] = now
+                self.stats['last_byte_time'] = now
+        return bytes(content)
+
+class MockSpeech:
+    '''
+    Recognizes audios uploaded to `storage` as `long_running_recognize` does.
+    
+    Each recognition is done `delay` seconds after it is started, plus one
+    second for every `speed` seconds of audio (0 for no time per second).
+    The words recognized are `words` as (word, start time, end time) in
+    seconds, cut to the length of the audio, or by default a word every
+    `_WORD_INTERVAL` seconds all the way through it. `num_requests` counts the
+    recognitions started.
+    '''
+    
+    def __init__(self, storage: MockStorage, delay=0., speed=0.,
+                 words: list[tuple[str, float, float]] = None):
+        self.storage = storage
+        self.delay = delay
+        self.speed = speed
+        self.words = words
+        self.num_requests = 0
+    
+    def long_running_recognize(
+            self, config: speech.RecognitionConfig,
+            audio: speech.RecognitionAudio) -> 'MockOperation':
+        self.num_requests += 1
+        if self.storage.latency: time.sleep(self.storage.latency)
+        blob_name = audio.uri.split('/', 3)[3]
+        if blob_name not in self.storage.blobs:
+            raise exceptions.NotFound(f'No such object: {audio.uri}')
+        duration = _get_duration(self.storage.blobs[blob_name], config)
+        if self.words is None:
+            words = []
+            start_time = _WORD_INTERVAL / 2
+            while start_time + _WORD_LENGTH <= duration:
+                words.append((_WORD_TEXTS[len(words) % len(_WORD_TEXTS)],
+                              start_time, start_time + _WORD_LENGTH))
+                start_time += _WORD_INTERVAL
+        else: words = [x for x in self.words if x[2] <= duration]
+        processing_time = self.delay
+        if self.speed: processing_time += duration / self.speed
+        return MockOperation(words, processing_time)
+
+class MockOperation:
+    '''A recognition that is done `processing_time` seconds after it starts.'''
+    
+    def __init__(self, words: list[tuple[str, float, float]],
+                 processing_time: float):
+        self.words = words
+        self.processing_time = processing_time
+        self.metadata = speech.LongRunningRecognizeMetadata(progress_percent=0)
+        self._start_time = time.monotonic()
+    
+    def done(self) -> bool:
+        elapsed = time.monotonic() - self._start_time
+        progress = (min(1, elapsed / self.processing_time)
+                    if self.processing_time else 1)
+        self.metadata.progress_percent = int(progress * 100)
+        return progress == 1
+    
+    def result(self) -> speech.LongRunningRecognizeResponse:
+        while not self.done():
+            time.sleep(min(.1, self.processing_time))
+        seconds = lambda x: datetime.timedelta(seconds=x)
+        alternative = speech.SpeechRecognitionAlternative(words=[
+            speech.WordInfo(word=word, start_time=seconds(start_time),
+                            end_time=seconds(end_time))
+            for word, start_time, end_time in self.words
+        ])
+        result = speech.SpeechRecognitionResult(alternatives=[alternative])
+        return speech.LongRunningRecognizeResponse(results=[result])
+
+def use(mock_storage: MockStorage, mock_speech: MockSpeech):
+    '''Makes `audio_transcriber` use the mocks instead of Google Cloud.'''
+    storage_client = mock_storage.make_client()
+    audio_transcriber._storage_client = storage_client
+    audio_transcriber._storage_bucket = storage_client.bucket(
+        audio_transcriber._BUCKET_NAME)
+    audio_transcriber._speech_client = mock_speech
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_POST(self):
+        # Starts a resumable upload
+        storage: MockStorage = self.server.storage
+        self._begin(storage)
+        content = self._receive(storage)
+        match = re.fullmatch(r'/upload/storage/v1/b/([^/]+)/o',
+                             parse.urlsplit(self.path).path)
+        if not match:
+            self._send(404, {'error': 'Not found'})
+            return
+        name = json.loads(content)['name']
+        upload_id = str(next(storage._upload_ids))
+        with storage._lock: storage._uploads[upload_id] = (name, bytearray())
+        location = f'{storage.endpoint}{self.path}&upload_id={upload_id}'
+        self._send(200, {}, {'Location': location})
+    
+    def do_PUT(self):
+        # Takes a chunk of a resumable upload, the last one once the total
+        # size is given and reached
+        storage: MockStorage = self.server.storage
+        self._begin(storage)
+        content = self._receive(storage)
+        query = parse.parse_qs(parse.urlsplit(self.path).query)
+        upload = storage._uploads.get(query.get('upload_id', [''])[0])
+        if not upload:
+            self._send(404, {'error': 'No such upload'})
+            return
+        name, uploaded = upload
+        uploaded += content
+        total = self.headers.get('Content-Range', '').rpartition('/')[2]
+        if total == '*' or int(total) > len(uploaded):
+            self._send(308, None, {'Range': f'bytes=0-{len(uploaded) - 1}'})
+            return
+        with storage._lock: storage.blobs[name] = bytes(uploaded)
+        self._send(200, {'name': name, 'size': str(len(uploaded))})
+    
+    def do_DELETE(self):
+        storage: MockStorage = self.server.storage
+        self._begin(storage)
+        self._receive(storage)
+        match = re.fullmatch(r'/storage/v1/b/([^/]+)/o/([^/]+)',
+                             parse.urlsplit(self.path).path)
+        name = match and parse.unquote(match.group(2))
+        with storage._lock: content = storage.blobs.pop(name, None)
+        if content is None:
+            self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        self._send(204, None)
+    
+    def log_message(self, *_):
+        pass
+    
+    def _begin(self, storage):
+        storage._count('requests')
+        if storage.latency: time.sleep(storage.latency)
+    
+    def _receive(self, storage):
+        return storage._receive(self.rfile,
+                                int(self.headers.get('Content-Length', 0)))
+    
+    def _send(self, status, content, headers: dict = None):
+        content = b'' if content is None else json.dumps(content).encode()
+        self.send_response_only(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+def _get_duration(content, config):
+    # In seconds, from the header of the FLAC or WAV
+    if config.encoding == speech.RecognitionConfig.AudioEncoding.FLAC:
+        # The STREAMINFO block, right after the marker and its block header
+        bits, = struct.unpack('>Q', content[18:26])
+        frame_rate = bits >> 44
+        num_frames = bits & (2**36 - 1)
+    else:
+        with wave.open(io.BytesIO(content), 'rb') as audio:
+            frame_rate = audio.getframerate()
+            num_frames = audio.getnframes()
+    return num_frames / frame_rate
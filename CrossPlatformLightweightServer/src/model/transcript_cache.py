@@ -0,0 +1,77 @@
+'''
+A local cache of the words recognized in audios, so that an audio that has
+been transcribed before is never uploaded and paid for again.
+
+Entries are keyed by a hash of the audio's content together with the settings
+that the words depend on, so a renamed or copied recording still hits, and an
+edited one or a change of language misses. An entry holds the words with their
+times, which is all that is needed to write a transcript in any layout. The
+least recently used entries are removed once the cache grows past `max_size`.
+'''
+
+import hashlib
+import json
+import os
+from os import path
+
+cache_dir_path = path.join(path.expanduser('~'), '.cache', 'wearable-ml',
+                           'transcripts')
+max_size = 2**28 # 256 MB
+
+_VERSION = 1
+_READ_SIZE = 2**20
+
+def get_key(audio_path: str, settings: dict) -> str:
+    '''
+    Returns the key of the words recognized in the audio at `audio_path` with
+    `settings`, which must be JSON-serializable.
+    '''
+    digest = hashlib.sha256()
+    with open(audio_path, 'rb') as audio:
+        while True:
+            content = audio.read(_READ_SIZE)
+            if not content: break
+            digest.update(content)
+    digest.update(json.dumps({'version': _VERSION, **settings},
+                             sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def load(key: str) -> list[tuple[str, int, int]]:
+    '''
+    Returns the cached words of `key` as (word, start time, end time), all
+    times in milliseconds, or None if they aren't cached.
+    '''
+    entry_path = _get_entry_path(key)
+    try:
+        with open(entry_path, encoding='utf-8') as entry:
+            words = [tuple(x) for x in json.load(entry)]
+    except (OSError, ValueError):
+        return None
+    os.utime(entry_path) # mark as recently used
+    return words
+
+def store(key: str, words: list[tuple[str, int, int]]):
+    '''Caches the `words` of `key`, removing old entries to make room.'''
+    os.makedirs(cache_dir_path, exist_ok=True)
+    entry_path = _get_entry_path(key)
+    # Write aside and swap in, so a crash never leaves half an entry
+    with open(entry_path + '.part', 'w', encoding='utf-8') as entry:
+        json.dump(words, entry, separators=(',', ':'))
+    os.replace(entry_path + '.part', entry_path)
+    _evict()
+
+def _get_entry_path(key):
+    return path.join(cache_dir_path, key + '.json')
+
+def _evict():
+    entries = []
+    with os.scandir(cache_dir_path) as scan:
+        for x in scan:
+            if x.name.endswith('.json'):
+                stat = x.stat()
+                entries.append((stat.st_mtime, stat.st_size, x.path))
+    size = sum(x[1] for x in entries)
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_size: break
+        os.remove(entry_path)
+        size -= entry_size
@@ -0,0 +1,220 @@
+'''
+A searchable index of the words spoken in every transcribed recording.
+
+The words recognized in each recording are kept with their times in an SQLite
+database at `index_path`, one small row of integers per word, with every
+distinct word stored once as a term. The words are ordered by term, so `find`
+answers "every moment someone said X" across thousands of hours with a lookup
+instead of a scan; a phrase is matched from its rarest term, by looking for
+the others at the positions around it. `add` updates the index one recording
+at a time, as transcripts arrive.
+
+Every match also gives the time range in the sensor readings recorded along
+with the audio; the watch starts both together and counts the `seconds` of the
+readings from the start of the recording.
+
+Usage: python -m model.transcript_index PHRASE
+'''
+
+import collections
+from contextlib import closing
+from datetime import datetime, timedelta
+import json
+import os
+from os import path
+import re
+import sqlite3
+import sys
+
+index_path = path.join(path.expanduser('~'), '.local', 'share', 'wearable-ml',
+                       'transcripts.db')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    audio_path TEXT NOT NULL UNIQUE,
+    key TEXT NOT NULL,
+    start_time TEXT,
+    sensor_path TEXT);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE,
+    count INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS words (
+    term_id INTEGER NOT NULL,
+    recording_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    PRIMARY KEY (term_id, recording_id, position)) WITHOUT ROWID;
+'''
+'''
+The words are stored in term order, so that the words are their own index and
+the times of a term are read from one place.
+'''
+_TIMEOUT = 30 # s, to wait for another process writing to the index
+_MAX_NUM_PARAMETERS = 500
+_TIME_FORMATS = (('%y-%m-%d-%H-%M-%S', 17), ('%Y-%m-%d %H-%M-%S', 19))
+'''
+How the watch (and older recorders) name recordings by their start time, with
+the length of the name it takes.
+'''
+
+def add(audio_path: str, words: list[tuple[str, int, int]], key: str):
+    '''
+    Indexes the `words` recognized in the audio at `audio_path` as (word,
+    start time, end time), all times in milliseconds, replacing any words
+    indexed for it before. Nothing is done if the words were indexed already
+    under the same `key`, such as a `transcript_cache` key.
+    '''
+    audio_path = path.abspath(audio_path)
+    with closing(_connect()) as db, db:
+        row = db.execute('SELECT id, key FROM recordings WHERE audio_path = ?',
+                         (audio_path,)).fetchone()
+        if row and row[1] == key: return
+        if row: _delete_words(db, row[0])
+        start_time = _get_start_time(audio_path)
+        recording_id = db.execute(
+            'INSERT OR REPLACE INTO recordings '
+            '(id, audio_path, key, start_time, sensor_path) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (row and row[0], audio_path, key,
+             start_time and start_time.isoformat(),
+             _find_sensor_path(audio_path))).lastrowid
+        terms = [(_normalize(word), start, end) for word, start, end in words]
+        terms = [x for x in terms if x[0]]
+        counts = collections.Counter(x for x, _, _ in terms)
+        term_ids = _get_term_ids(db, counts)
+        db.executemany(
+            'INSERT INTO words VALUES (?, ?, ?, ?, ?)',
+            ((term_ids[term], recording_id, i, start, max(0, end - start))
+             for i, (term, start, end) in enumerate(terms)))
+        db.executemany('UPDATE terms SET count = count + ? WHERE id = ?',
+                       ((n, term_ids[x]) for x, n in counts.items()))
+
+def remove(audio_path: str):
+    '''Removes the words of the audio at `audio_path` from the index.'''
+    with closing(_connect()) as db, db:
+        row = db.execute('SELECT id FROM recordings WHERE audio_path = ?',
+                         (path.abspath(audio_path),)).fetchone()
+        if not row: return
+        _delete_words(db, row[0])
+        db.execute('DELETE FROM recordings WHERE id = ?', row)
+
+def find(phrase: str, limit: int = None) -> list[dict]:
+    '''
+    Returns every moment that the words of `phrase` were said one after
+    another (ignoring case and punctuation), by recording in the order they
+    were indexed, and up to `limit` moments, as:
+    
+    - 'audio_path': the recording
+    - 'start_time', 'end_time': milliseconds into the recording
+    - 'sensor_path': the sensor CSV recorded along with it, or None
+    - 'sensor_start', 'sensor_end': the range of `seconds` in the sensor
+      readings
+    - 'recorded_at': when it was said (ISO 8601, local time), or None if the
+      recording is not named by its start time
+    '''
+    terms = [x for x in map(_normalize, phrase.split()) if x]
+    if not terms: return []
+    unique_terms = tuple(set(terms))
+    with closing(_connect()) as db:
+        term_ids = {}
+        counts = {}
+        for term, id, count in db.execute(
+                'SELECT term, id, count FROM terms WHERE count > 0 AND term IN '
+                f'({", ".join("?" * len(unique_terms))})', unique_terms):
+            term_ids[term] = id
+            counts[term] = count
+        if len(term_ids) < len(unique_terms): return []
+        # Go through the times of the rarest term, and look for each other
+        # term at its position around it
+        k = min(range(len(terms)), key=lambda i: counts[terms[i]])
+        joins = ''.join(
+            f' CROSS JOIN words w{i} ON w{i}.term_id = {term_ids[x]} AND '
+            f'w{i}.recording_id = w{k}.recording_id AND '
+            f'w{i}.position = w{k}.position + {i - k}'
+            for i, x in enumerate(terms) if i != k)
+        last = len(terms) - 1
+        query = (
+            f'SELECT r.audio_path, r.start_time, r.sensor_path, w0.start_time, '
+            f'w{last}.start_time + w{last}.duration FROM words w{k}{joins} '
+            f'CROSS JOIN recordings r ON r.id = w{k}.recording_id '
+            f'WHERE w{k}.term_id = {term_ids[terms[k]]} '
+            f'ORDER BY w{k}.recording_id, w{k}.position')
+        if limit is not None: query += f' LIMIT {int(limit)}'
+        rows = db.execute(query).fetchall()
+    matches = []
+    for audio_path, recording_start, sensor_path, start, end in rows:
+        recorded_at = None
+        if recording_start:
+            recorded_at = (datetime.fromisoformat(recording_start) +
+                           timedelta(milliseconds=start)).isoformat()
+        matches.append({
+            'audio_path': audio_path,
+            'start_time': start,
+            'end_time': end,
+            'sensor_path': sensor_path,
+            'sensor_start': start / 10**3,
+            'sensor_end': end / 10**3,
+            'recorded_at': recorded_at,
+        })
+    return matches
+
+def _connect():
+    os.makedirs(path.dirname(index_path), exist_ok=True)
+    db = sqlite3.connect(index_path, timeout=_TIMEOUT)
+    # Readers don't block the writer, and the other way around
+    db.execute('PRAGMA journal_mode = WAL')
+    db.executescript(_SCHEMA)
+    return db
+
+def _normalize(word):
+    # "Hello," and "hello" are the same term, but "don't" keeps its apostrophe
+    return re.sub(r"[^\w']+", '', word.lower()).strip("'")
+
+def _delete_words(db, recording_id):
+    # Looked up term by term, which is quicker than going through all words
+    counts = db.execute(
+        'SELECT term_id, count(*) FROM words WHERE recording_id = ? AND '
+        'term_id IN (SELECT id FROM terms) GROUP BY term_id',
+        (recording_id,)).fetchall()
+    db.execute(
+        'DELETE FROM words WHERE recording_id = ? AND '
+        'term_id IN (SELECT id FROM terms)', (recording_id,))
+    db.executemany('UPDATE terms SET count = count - ? WHERE id = ?',
+                   ((n, x) for x, n in counts))
+
+def _get_term_ids(db, terms):
+    terms = list(terms)
+    db.executemany('INSERT OR IGNORE INTO terms (term) VALUES (?)',
+                   ((x,) for x in terms))
+    term_ids = {}
+    for i in range(0, len(terms), _MAX_NUM_PARAMETERS):
+        chunk = terms[i:i + _MAX_NUM_PARAMETERS]
+        term_ids.update((term, id) for id, term in db.execute(
+            'SELECT id, term FROM terms WHERE term IN '
+            f'({", ".join("?" * len(chunk))})', chunk))
+    return term_ids
+
+def _get_start_time(audio_path):
+    # Recordings are named like '21-07-05-15-27-00-Audio.wav'
+    stem = path.splitext(path.basename(audio_path))[0]
+    for time_format, length in _TIME_FORMATS:
+        try:
+            return datetime.strptime(stem[:length], time_format)
+        except ValueError:
+            pass
+    return None
+
+def _find_sensor_path(audio_path):
+    stem = path.splitext(audio_path)[0]
+    stems = [stem]
+    if stem.endswith('-Audio'): stems.insert(0, stem[:-len('Audio')] + 'Sensor')
+    for sensor_path in (x + '.csv' for x in stems):
+        if path.exists(sensor_path): return sensor_path
+    return None
+
+if __name__ == '__main__':
+    json.dump(find(' '.join(sys.argv[1:])), sys.stdout, indent=2)
+    print()
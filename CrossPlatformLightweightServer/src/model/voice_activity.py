@@ -0,0 +1,170 @@
+'''
+Finds where there is speech in a recording, so that only those parts need to
+be transcribed.
+
+A watch records for hours, mostly silence and ambient noise. `find_speech`
+reads a WAV a block at a time and splits it into short frames, then marks as
+speech the frames that are well above the noise floor in energy (or loud
+enough to be speech whatever the floor), along with quieter but hissing frames
+(many zero crossings, as in "s" and "f") next to them, all with vectorized
+NumPy. `SpeechMap` packs the speech into one shorter audio with a little
+silence between the parts, and maps times in the packed audio back to times in
+the recording.
+'''
+
+from collections.abc import Iterator
+import numpy
+import wave
+
+_FRAME_LENGTH = .03 # s
+_READ_NUM_FRAMES = 2**10 # frames of _FRAME_LENGTH
+_MIN_NOISE_LEVEL = 20 # dB, of the RMS in 16-bit units
+_MAX_NOISE_LEVEL = 40 # dB
+'''
+Never take the noise floor above x dB, so that frames louder than x plus the
+margin always count as speech; in a recording that is all speech, the
+percentile lands on the quietest speech rather than on noise.
+'''
+_NOISE_PERCENTILE = 10
+'''
+Take the level that x percent of the frames are below as the noise floor;
+recordings are mostly not speech.
+'''
+_SPEECH_MARGIN = 10 # dB above the noise floor
+_HISS_MARGIN = 3 # dB above the noise floor
+_HISS_REACH = .3 # s
+'''Count hissing frames as speech within x seconds of louder speech.'''
+_MIN_SPEECH_LENGTH = .09 # s, shorter bursts are taken as clicks
+_PADDING = .3 # s
+'''
+Keep x seconds before and after every part of speech, which also joins parts
+less than twice that apart.
+'''
+_GAP_LENGTH = .75 # s
+'''
+Put x seconds of silence between the parts when packing them, more than
+`audio_transcriber._LINE_INTERVAL` so that every part starts a new line.
+'''
+
+def find_speech(audio_path: str) -> list[tuple[int, int]]:
+    '''
+    Returns the parts of the 16-bit WAV at `audio_path` that may have speech,
+    as [start frame, end frame) of the audio.
+    '''
+    with wave.open(audio_path, 'rb') as audio:
+        if audio.getsampwidth() != 2:
+            raise ValueError('Only 16-bit audio is supported')
+        frame_rate = audio.getframerate()
+        num_channels = audio.getnchannels()
+        num_audio_frames = audio.getnframes()
+        frame_length = max(1, round(_FRAME_LENGTH * frame_rate))
+        levels = []
+        crossing_rates = []
+        while True:
+            samples = numpy.frombuffer(
+                audio.readframes(frame_length * _READ_NUM_FRAMES), '<i2')
+            num_frames = len(samples) // num_channels // frame_length
+            if num_frames == 0: break
+            frames = samples[:num_frames * frame_length * num_channels].reshape(
+                num_frames, frame_length, num_channels).mean(axis=2)
+            energies = (frames**2).mean(axis=1)
+            levels.append(10 * numpy.log10(numpy.maximum(energies, 1)))
+            signs = numpy.signbit(frames)
+            crossing_rates.append((signs[:, 1:] != signs[:, :-1]).mean(axis=1))
+    if not levels: return []
+    levels = numpy.concatenate(levels)
+    crossing_rates = numpy.concatenate(crossing_rates)
+    noise_level = numpy.clip(numpy.percentile(levels, _NOISE_PERCENTILE),
+                             _MIN_NOISE_LEVEL, _MAX_NOISE_LEVEL)
+    is_loud = levels > noise_level + _SPEECH_MARGIN
+    is_loud &= _get_run_lengths(is_loud) * _FRAME_LENGTH >= _MIN_SPEECH_LENGTH
+    # Hissing: more zero crossings than almost all of the background
+    is_noise = ~is_loud
+    if is_noise.any():
+        crossing_threshold = numpy.percentile(crossing_rates[is_noise], 95)
+    else: crossing_threshold = 0
+    is_hissing = ((crossing_rates > crossing_threshold) &
+                  (levels > noise_level + _HISS_MARGIN))
+    is_speech = is_loud | is_hissing & _dilate(is_loud, _HISS_REACH)
+    is_speech = _dilate(is_speech, _PADDING)
+    # Turn the runs of speech into ranges of audio frames
+    edges = numpy.diff(numpy.concatenate(([0], is_speech.astype(numpy.int8),
+                                          [0])))
+    starts = numpy.flatnonzero(edges == 1) * frame_length
+    ends = numpy.minimum(numpy.flatnonzero(edges == -1) * frame_length,
+                         num_audio_frames)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+class SpeechMap:
+    '''
+    The `parts` of an audio at `frame_rate` (as returned by `find_speech`)
+    packed one after another, with a short silence between each two.
+    '''
+    
+    def __init__(self, parts: list[tuple[int, int]], frame_rate: int):
+        self.frame_rate = frame_rate
+        self.source_starts = numpy.array([x for x, _ in parts], numpy.int64)
+        self.lengths = numpy.array([y - x for x, y in parts], numpy.int64)
+        gap_length = round(_GAP_LENGTH * frame_rate)
+        self.starts = (numpy.cumsum(self.lengths) - self.lengths +
+                       gap_length * numpy.arange(len(parts)))
+        self.num_frames = (int(self.starts[-1] + self.lengths[-1])
+                           if len(parts) else 0)
+    
+    def read(self, audio: wave.Wave_read, start_frame: int, num_frames: int,
+             block_num_frames: int) -> Iterator[numpy.ndarray]:
+        '''
+        Reads frames [`start_frame`, `start_frame` + `num_frames`) of the
+        packed audio from the `audio` it was found in, and yields them as
+        int16 arrays of (samples, channels) about `block_num_frames` long.
+        '''
+        num_channels = audio.getnchannels()
+        end_frame = start_frame + num_frames
+        position = start_frame
+        while position < end_frame:
+            # In a part, or in the gap after it
+            i = int(numpy.searchsorted(self.starts, position, 'right')) - 1
+            part_end = int(self.starts[i] + self.lengths[i])
+            if position < part_end:
+                count = min(part_end, end_frame, position + block_num_frames)
+                count -= position
+                audio.setpos(int(self.source_starts[i]) + position -
+                             int(self.starts[i]))
+                frames = numpy.frombuffer(audio.readframes(count), '<i2')
+                frames = frames.reshape(-1, num_channels)
+                if len(frames) < count: # cut off early
+                    missing = numpy.zeros((count - len(frames), num_channels),
+                                          numpy.int16)
+                    frames = numpy.concatenate((frames, missing))
+            else:
+                next_start = (int(self.starts[i + 1])
+                              if i + 1 < len(self.starts) else end_frame)
+                count = min(next_start, end_frame) - position
+                frames = numpy.zeros((count, num_channels), numpy.int16)
+            yield frames
+            position += count
+    
+    def to_source_time(self, millis: int) -> int:
+        '''
+        Returns the time in the source audio (in milliseconds) of a time in
+        the packed audio; times in a gap are taken to the end of the part
+        before it.
+        '''
+        frame = millis * self.frame_rate / 10**3
+        i = max(0, int(numpy.searchsorted(self.starts, frame, 'right')) - 1)
+        offset = min(frame - self.starts[i], self.lengths[i])
+        return round((self.source_starts[i] + offset) * 10**3 / self.frame_rate)
+
+def _get_run_lengths(flags):
+    # The length of the run of equal flags that each flag is in
+    edges = numpy.flatnonzero(numpy.diff(flags.astype(numpy.int8))) + 1
+    bounds = numpy.concatenate(([0], edges, [len(flags)]))
+    return numpy.repeat(numpy.diff(bounds), numpy.diff(bounds))
+
+def _dilate(flags, seconds):
+    # Also sets the flags within `seconds` of a set flag
+    reach = round(seconds / _FRAME_LENGTH)
+    if reach == 0 or not flags.any(): return flags
+    counts = numpy.convolve(flags, numpy.ones(2 * reach + 1, numpy.int64),
+                            'same')
+    return counts > 0
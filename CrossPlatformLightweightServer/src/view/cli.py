@@ -0,0 +1,118 @@
+'''
+Transcribes audios from the command line, for scripts and scheduled jobs.
+
+Progress goes to stdout as JSON lines, one object per event, each with the
+'event' and the seconds 'elapsed' since the start:
+
+- 'start': the 'paths' given
+- 'progress': the 'path' of an audio, its 'stage' ('upload' or 'transcribe')
+  and its 'progress' from 0 to 1
+- 'done': the 'path' of an audio and the 'target' SRT written
+- 'error': the 'path' of an audio and the 'error' that stopped it
+- 'summary': the number of audios 'transcribed' and 'failed'
+
+The exit status is 0 if every audio was transcribed, and 1 otherwise. The
+cloud libraries take about half a second to load, so they are only imported
+once the arguments are found to be valid. The `metrics` of the run can be kept
+in a Prometheus text file, and its stages and uploads in a JSON lines file.
+
+Usage: python app.py [--credential PATH] [--target SRT] [--segment-length S]
+                     [--keep-silence] [--metrics PATH] [--events PATH]
+                     SOURCE...
+'''
+
+import argparse
+import contextlib
+import json
+import os
+from os import path
+import sys
+import time
+
+_CREDENTIAL_VARIABLE = 'GOOGLE_APPLICATION_CREDENTIALS'
+
+def main(args: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Transcribe WAV audios into SRT subtitles with Google.')
+    parser.add_argument('sources', metavar='source', nargs='+',
+                        help='WAV audio, or directory of them, to transcribe')
+    parser.add_argument('-c', '--credential',
+                        default=os.environ.get(_CREDENTIAL_VARIABLE),
+                        help='JSON credential of a Google service account '
+                        f'(default: ${_CREDENTIAL_VARIABLE})')
+    parser.add_argument('-o', '--target',
+                        help='SRT to write when transcribing a single audio '
+                        '(default: next to the audio, of the same name)')
+    parser.add_argument('-s', '--segment-length', type=float,
+                        help='seconds of audio per segment, or 0 for none '
+                        '(default: 5 minutes)')
+    parser.add_argument('-k', '--keep-silence', action='store_true',
+                        help='transcribe the silent parts too')
+    parser.add_argument('-m', '--metrics', metavar='PATH',
+                        help='keep the metrics in this file in the Prometheus '
+                        'text format')
+    parser.add_argument('-e', '--events', metavar='PATH',
+                        help='append every stage, upload and error to this '
+                        'file as JSON lines')
+    args = parser.parse_args(args)
+    if not args.credential:
+        parser.error(f'a credential is required, or ${_CREDENTIAL_VARIABLE}')
+    if args.target and (len(args.sources) > 1 or path.isdir(args.sources[0])):
+        parser.error('--target only goes with a single audio')
+    for source_path in args.sources:
+        if not path.exists(source_path):
+            parser.error(f'no such file or directory: \'{source_path}\'')
+    options = {'should_skip_silence': not args.keep_silence}
+    if args.segment_length is not None:
+        options['segment_length'] = args.segment_length
+    start_time = time.monotonic()
+    num_done = 0
+    output = sys.stdout
+    
+    def emit(event, **values):
+        print(json.dumps({
+            'event': event,
+            'elapsed': round(time.monotonic() - start_time, 3),
+            **values
+        }), file=output, flush=True)
+    
+    def on_progress(audio_path, stage, progress):
+        nonlocal num_done
+        if stage == 'done':
+            num_done += 1
+            target_path = args.target or path.splitext(audio_path)[0] + '.srt'
+            emit('done', path=audio_path, target=target_path)
+        else:
+            emit('progress', path=audio_path, stage=stage,
+                 progress=round(progress, 4))
+    
+    emit('start', paths=args.sources)
+    from model import audio_transcriber, metrics
+    if args.metrics: metrics.start_export(args.metrics)
+    if args.events: metrics.events_file = open(args.events, 'a')
+    errors = {}
+    # Keep stdout clean for the events
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            audio_transcriber.start(args.credential)
+            if args.target:
+                try:
+                    audio_transcriber.transcribe(
+                        args.sources[0], args.target,
+                        lambda *x: on_progress(args.sources[0], *x), **options)
+                    on_progress(args.sources[0], 'done', 1)
+                except Exception as ex:
+                    errors[args.sources[0]] = ex
+            else:
+                errors = audio_transcriber.transcribe_all(
+                    args.sources, on_progress, **options)
+        except Exception as ex: # the credential is no good
+            errors = {x: ex for x in args.sources}
+        finally:
+            metrics.stop_export()
+            if metrics.events_file: metrics.events_file.close()
+            metrics.events_file = None
+    for audio_path, error in errors.items():
+        emit('error', path=audio_path, error=f'{type(error).__name__}: {error}')
+    emit('summary', transcribed=num_done, failed=len(errors))
+    return 1 if errors else 0
@@ -0,0 +1,32 @@
+'''
+Carries events from the transcribing thread to the window's event loop.
+
+PySimpleGUI windows must only be updated from the thread that reads their
+events, so the transcriber's progress and result are handed to an
+`EventChannel` instead of touching widgets. The transcriber reports progress
+once per polling round, so every event is delivered as it is sent.
+'''
+
+from PySimpleGUI import Window
+from threading import Lock
+
+class EventChannel:
+    '''
+    Delivers events to `window` as (key, value) through `Window.read`, where
+    the value is found in the values under the key.
+    '''
+    
+    def __init__(self, window: Window):
+        self.window = window
+        self._lock = Lock()
+        self._is_closed = False
+    
+    def send(self, key: str, value=None):
+        '''Delivers an event, unless the channel is closed.'''
+        with self._lock:
+            if self._is_closed: return
+            self.window.write_event_value(key, value)
+    
+    def close(self):
+        '''Stops delivering events, such as when the window is closed.'''
+        with self._lock: self._is_closed = True
@@ -6,16 +6,19 @@ Qianlang Chen and Kevin Song
 M 05/03/21
 '''
 
-from model import audio_transcriber
+from view.event_channel import EventChannel
 
 from os import path
 import PySimpleGUI
+from threading import Thread
+import traceback
 import webbrowser
 
 _gui: PySimpleGUI.Window
+_channel: EventChannel
 
 def start():
-    global _gui
+    global _gui, _channel
     _gui = PySimpleGUI.Window(
         background_color='#101010',
         button_color='#606060',
@@ -55,8 +58,13 @@ def start():
                                          max_value=1,
                                          size=(24, 12)),)),
         margins=(48, 36),
-        title='Transcribe Audio')
+        title='Transcribe Audio',
+        finalize=True)
+    # Transcribing is done on another thread, so the window stays responsive
+    _channel = EventChannel(_gui)
     credential_path = source_path = target_path = None
+    started_credential_path = None
+    is_transcribing = False
     while True:
         event, values = _gui.read()
         if event == PySimpleGUI.WIN_CLOSED: break
@@ -78,22 +86,52 @@ def start():
                                                 disabled=True)
             _gui['progress_text'].update('0%')
             _gui['progress_bar'].update(0)
-            audio_transcriber.start(credential_path)
-            audio_transcriber.transcribe(source_path, target_path,
-                                         _on_audio_transcriber_progress)
+            # Reuse the clients unless the credential has changed
+            should_start = credential_path != started_credential_path
+            started_credential_path = credential_path
+            is_transcribing = True
+            Thread(target=_transcribe,
+                   args=(credential_path if should_start else None,
+                         source_path, target_path),
+                   daemon=True).start()
+        elif event == 'transcriber_progress':
+            stage, progress = values[event]
+            if stage == 'upload': progress_stage = 'Uploading...'
+            elif stage == 'transcribe': progress_stage = 'Transcribing...'
+            _gui['progress_text'].update(progress_stage + f' {progress:.0%}')
+            _gui['progress_bar'].update(progress)
+        elif event == 'transcriber_done':
+            error = values[event]
+            is_transcribing = False
             for button in ('credential', 'source', 'target', 'transcribe'):
                 _gui[button + '_button'].update(button_color='#606060',
                                                 disabled=False)
+            if error:
+                # Start the clients over in case the credential was the problem
+                started_credential_path = None
+                _gui['progress_text'].update('Failed!')
+                continue
             _gui['progress_text'].update('Done! 100%')
             _gui['progress_bar'].update(1)
             webbrowser.open(path.dirname(target_path))
-        if credential_path and source_path and target_path:
+        # One transcription at a time: Transcribe stays off until it is done
+        if (credential_path and source_path and target_path and
+                not is_transcribing):
             _gui['transcribe_button'].update(button_color='#606060',
                                              disabled=False)
+    _channel.close()
 
-def _on_audio_transcriber_progress(stage, progress):
-    global _gui
-    if stage == 'upload': progress_stage = 'Uploading...'
-    elif stage == 'transcribe': progress_stage = 'Transcribing...'
-    _gui['progress_text'].update(progress_stage + f' {progress:.0%}')
-    _gui['progress_bar'].update(progress)
+def _transcribe(credential_path, source_path, target_path):
+    # Runs on its own thread and reports back through the channel
+    try:
+        # Slow to load, so only once needed rather than before the window shows
+        from model import audio_transcriber
+        if credential_path: audio_transcriber.start(credential_path)
+        audio_transcriber.transcribe(
+            source_path, target_path,
+            lambda *args: _channel.send('transcriber_progress', args))
+    except Exception as error:
+        traceback.print_exc()
+        _channel.send('transcriber_done', error)
+        return
+    _channel.send('transcriber_done', None)
@@ -6,14 +6,13 @@ Qianlang Chen
 F 07/02/21
 '''
 
-from collections.abc import Callable
-from http.client import HTTPResponse
-import math
-from os import path
+import discovery
+from event_channel import EventChannel
+import ipaddress
 import PySimpleGUI
-from PySimpleGUI import Button, Element, Input, Listbox, Text, Window
+from PySimpleGUI import Button, Checkbox, Combo, Element, Listbox, Text, Window
+from retriever import Retriever
 from threading import Thread
-from urllib import request
 import webbrowser
 
 class App:
@@ -23,9 +22,10 @@ class App:
 class Gui:
     _window: Window = None
     _info_text: Text = None
-    _address_input: Input = None
+    _address_input: Combo = None
     _address_input_value = ''
     _load_button: Button = None
+    _scan_button: Button = None
     _file_list: Listbox = None
     _file_list_selection: tuple[str] = ()
     _selection_text: Text = None
@@ -34,8 +34,12 @@ class Gui:
     _retrieve_button: Button = None
     _retrieve_button_handle: Button = None
     _retrieve_button_selection = ''
+    _retrieve_target_dir_path = ''
     _delete_button: Button = None
+    _sync_checkbox: Checkbox = None
+    _archive_checkbox: Checkbox = None
     _is_element_disabled: dict[Element, bool] = None
+    _channel: EventChannel = None
     
     def start():
         Gui._info_text = Text(background_color='#101010',
@@ -45,11 +49,15 @@ class Gui:
                               border_width=8,
                               size=(24, 1),
                               text='Enter sensor address')
-        Gui._address_input = Input(default_text='192.168.0.', key='address_input', size=(16, 1))
+        Gui._address_input = Combo(values=(),
+                                   default_value='192.168.0.',
+                                   key='address_input',
+                                   size=(22, 1))
         Gui._load_button = Button(bind_return_key=True,
                                   button_text='Load',
                                   key='load_button',
                                   size=(6, 1))
+        Gui._scan_button = Button(button_text='Scan', key='scan_button', size=(6, 1))
         Gui._file_list = Listbox(values=(),
                                  background_color='#e0e4f0',
                                  enable_events=True,
@@ -86,10 +94,22 @@ class Gui:
                                     disabled=True,
                                     key='delete_button',
                                     size=(12, 1))
+        Gui._sync_checkbox = Checkbox(background_color='#101010',
+                                      default=Retriever.should_sync,
+                                      font=(None, 14),
+                                      key='sync_checkbox',
+                                      text='Skip retrieved files')
+        Gui._archive_checkbox = Checkbox(background_color='#101010',
+                                         default=Retriever.should_archive,
+                                         font=(None, 14),
+                                         key='archive_checkbox',
+                                         text='Compress into an archive')
         Gui._is_element_disabled = {
-            x: False for x in (Gui._address_input, Gui._load_button, Gui._file_list,
+            x: False for x in (Gui._address_input, Gui._load_button, Gui._scan_button,
+                               Gui._file_list,
                                Gui._select_all_button, Gui._deselect_all_button,
-                               Gui._retrieve_button, Gui._delete_button)
+                               Gui._retrieve_button, Gui._delete_button, Gui._sync_checkbox,
+                               Gui._archive_checkbox)
         }
         
         Gui._window = Window(background_color='#101010',
@@ -98,11 +118,12 @@ class Gui:
                              font=(None, 16),
                              layout=(
                                  (Gui._info_text,),
-                                 (Gui._address_input, Gui._load_button),
+                                 (Gui._address_input, Gui._load_button, Gui._scan_button),
                                  (Gui._file_list,),
                                  (Gui._selection_text,),
                                  (Gui._select_all_button, Gui._deselect_all_button),
                                  (Gui._retrieve_button, Gui._delete_button),
+                                 (Gui._sync_checkbox, Gui._archive_checkbox),
                                  (Gui._retrieve_button_handle,),
                              ),
                              margins=(48, 48),
@@ -110,6 +131,8 @@ class Gui:
         Gui._window.finalize()
         Gui._address_input.update(select=True)
         Gui._address_input.set_focus(True)
+        # Work is done on other threads, which report back through the event loop
+        Gui._channel = EventChannel(Gui._window)
         
         while True:
             event, values = Gui._window.read()
@@ -117,13 +140,30 @@ class Gui:
             Gui._address_input_value = values['address_input']
             Gui._file_list_selection = values['file_list']
             Gui._retrieve_button_selection = values['retrieve_button']
+            Retriever.should_sync = values['sync_checkbox']
+            Retriever.should_archive = values['archive_checkbox']
             if event == 'load_button': Gui._handle_load_button_clicked()
+            elif event == 'scan_button': Gui._handle_scan_button_clicked()
             elif event == 'file_list': Gui._handle_file_list_selected()
             elif event == 'select_all_button': Gui._handle_select_all_button_clicked()
             elif event == 'deselect_all_button': Gui._handle_deselect_all_button_clicked()
             elif event == 'retrieve_button_handle': Gui._handle_retrieve_button_selected()
             elif event == 'delete_button': Gui._handle_delete_button_clicked()
+            elif event == 'discovered_sensors': Gui._handle_discovered_sensors(values[event])
+            elif event == 'got_files': Gui._handle_retriever_got_files(*values[event])
+            elif event == 'retrieving_files':
+                Gui._handle_retriever_retrieving_files(*values[event])
+            elif event == 'deleted_files': Gui._handle_retriever_deleted_files(values[event])
             else: print('Unhandled:', event, values)
+        Gui._channel.close()
+    
+    def _get_scan_network(address):
+        # Scans the /24 network of a (partial) address unless a CIDR network is given
+        address = address.split(' ')[0]
+        if '/' not in address:
+            octets = address.strip('.').split('.')[:3]
+            address = '.'.join(octets + ['0'] * (4 - len(octets))) + '/24'
+        return str(ipaddress.ip_network(address, strict=False))
     
     def _format_x_files(x):
         return f'{x:,} file{(x > 1) * "s"}'
@@ -151,8 +191,22 @@ class Gui:
         Gui._info_text.update('Loading files...')
         Gui._update_file_list(())
         Gui._update_selection_indication(0)
-        Retriever.address = Gui._address_input_value
-        Retriever.get_files(Gui._handle_retriever_got_files)
+        # Discovered sensors are listed along with their file counts
+        Retriever.address = Gui._address_input_value.split(' ')[0]
+        Retriever.get_files(lambda *args: Gui._channel.send('got_files', args))
+    
+    def _handle_scan_button_clicked():
+        try: network = Gui._get_scan_network(Gui._address_input_value)
+        except ValueError:
+            Gui._info_text.update('Invalid address')
+            return
+        Gui._disable_window(True)
+        Gui._info_text.update('Scanning for sensors...')
+        
+        def f():
+            Gui._channel.send('discovered_sensors', discovery.discover(network))
+        
+        Thread(target=f).start()
     
     def _handle_file_list_selected():
         Gui._update_selection_indication(len(Gui._file_list_selection))
@@ -169,8 +223,9 @@ class Gui:
     def _handle_retrieve_button_selected():
         if not Gui._retrieve_button_selection: return
         Gui._disable_window(True)
-        Retriever.retrieve_files(Gui._file_list_selection, Gui._retrieve_button_selection,
-                                 Gui._handle_retriever_retrieving_files)
+        Gui._retrieve_target_dir_path = Gui._retrieve_button_selection
+        Retriever.retrieve_files(Gui._file_list_selection, Gui._retrieve_target_dir_path,
+                                 Gui._post_retrieving_files)
         Gui._info_text.update(f'Preparing to retrieve...')
         # Set internal value for retrieve_button so it wouldn't report the previous selection
         # when the user cancels the second prompt
@@ -187,7 +242,24 @@ class Gui:
             Gui._disable_window(False)
             return
         Gui._info_text.update(f'Deleting {Gui._format_x_files(count)}...')
-        Retriever.delete_files(Gui._file_list_selection, Gui._handle_retriever_deleted_files)
+        Retriever.delete_files(Gui._file_list_selection,
+                               lambda message: Gui._channel.send('deleted_files', message))
+    
+    def _post_retrieving_files(message, progress):
+        # Called from the workers after every chunk, so only the outcome is sent right away
+        if message or progress == 1.:
+            Gui._channel.send('retrieving_files', (message, progress))
+        else: Gui._channel.post('retrieving_files', (message, progress))
+    
+    def _handle_discovered_sensors(sensors):
+        Gui._disable_window(False)
+        if not sensors:
+            Gui._info_text.update('No sensors found')
+            return
+        Gui._info_text.update(f'Found {len(sensors)} sensor{(len(sensors) > 1) * "s"}')
+        values = tuple(
+            f'{address} ({Gui._format_x_files(count)})' for address, count in sensors)
+        Gui._address_input.update(values=values, value=values[0])
     
     def _handle_retriever_got_files(message, files):
         Gui._disable_window(False)
@@ -205,7 +277,7 @@ class Gui:
             Gui._disable_window(False)
             Gui._info_text.update(
                 f'Successfully retrieved {Gui._format_x_files(len(Gui._file_list_selection))}!')
-            webbrowser.open(Gui._retrieve_button_selection)
+            webbrowser.open(Gui._retrieve_target_dir_path)
             return
         Gui._info_text.update(f'Retrieving... ({progress:.0%})')
     
@@ -221,92 +293,4 @@ class Gui:
                   if x not in Gui._file_list_selection))
         Gui._update_selection_indication(0)
 
-class Retriever:
-    _CONNECTION_FAILED_MESSAGE = 'Connection failed!'
-    _MAX_NUM_ATTEMPTS = 6
-    
-    address: str = None
-    
-    def get_files(on_got_files: Callable[[str, tuple[str]], None]):
-        def f():
-            for _ in range(Retriever._MAX_NUM_ATTEMPTS):
-                try:
-                    response = Retriever._request('list')
-                    file_names = response.read().decode('utf-8').strip().split('\n')
-                    on_got_files(None, tuple(sorted(file_names)))
-                    break
-                except Exception as ex: print('Caught:', ex)
-            else:
-                on_got_files(Retriever._CONNECTION_FAILED_MESSAGE, None)
-        
-        Thread(target=f).start()
-    
-    def retrieve_files(file_names: tuple[str], target_dir_path: str,
-                       on_retrieving_files: Callable[[str, float], None]):
-        def f():
-            total_bytes = 0
-            for name in file_names:
-                for _ in range(Retriever._MAX_NUM_ATTEMPTS):
-                    try:
-                        response = Retriever._request('size', name)
-                        total_bytes += int(response.read().decode('utf-8'))
-                        break
-                    except Exception as ex: print('Caught:', ex)
-                else:
-                    on_retrieving_files(Retriever._CONNECTION_FAILED_MESSAGE, math.nan)
-                    return
-            
-            on_retrieving_files(None, 0.)
-            bytes_loaded = max_bytes_loadoed = 0
-            for name in file_names:
-                for _ in range(Retriever._MAX_NUM_ATTEMPTS):
-                    try:
-                        old_bytes_loaded = bytes_loaded
-                        response = Retriever._request('retrieve', name)
-                        target_path = path.join(target_dir_path, name)
-                        with open(target_path, 'wb') as target:
-                            while True:
-                                data = response.read(2**20)
-                                if not data: break
-                                target.write(data)
-                                bytes_loaded += len(data)
-                                if bytes_loaded > max_bytes_loadoed:
-                                    max_bytes_loadoed = bytes_loaded
-                                    on_retrieving_files(None, bytes_loaded / (total_bytes or 1))
-                        break
-                    except Exception as ex:
-                        print('Caught:', ex)
-                        bytes_loaded = old_bytes_loaded
-                else:
-                    on_retrieving_files(Retriever._CONNECTION_FAILED_MESSAGE, math.nan)
-                    return
-            
-            on_retrieving_files(None, 1.)
-        
-        Thread(target=f).start()
-    
-    def delete_files(file_names: tuple[str], on_deleted_files: Callable[[str], None]):
-        def f():
-            for name in file_names:
-                for _ in range(Retriever._MAX_NUM_ATTEMPTS):
-                    try:
-                        response = Retriever._request('delete', name)
-                        content = response.read()
-                        if content != b'1': raise Exception(f'Failed to delete: {content}')
-                        break
-                    except Exception as ex: print('Caught:', ex)
-                else:
-                    on_deleted_files(Retriever._CONNECTION_FAILED_MESSAGE)
-                    return
-            
-            on_deleted_files(None)
-        
-        Thread(target=f).start()
-    
-    def _request(command, *args) -> HTTPResponse:
-        formatted_args = (len(args) > 0) * ':' + ','.join(map(str, args))
-        url = f'http://{Retriever.address}:3456/{command}{formatted_args}'
-        print('Open:', url)
-        return request.urlopen(url, timeout=1)
-
 if __name__ == '__main__': App.start()
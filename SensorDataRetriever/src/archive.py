@@ -0,0 +1,235 @@
+'''
+A compressed, content-addressed store of retrieved recordings.
+
+Each file is streamed through a SHA-256 hash and a bzip2 compressor as it arrives, and is
+kept once under its hash no matter how many times (or from how many watches) it is
+retrieved. A catalog in SQLite maps every watch's files to their content and groups them by
+session, the name that the WAV and the sensor CSV of a recording share (see
+`recording_names.get_session_name`), so that a file is found without touching the objects.
+`Archive.open` reads a file back decompressing as it goes, and `Archive.extract` writes it
+out for code that needs a file on disk, such as `session.Session`. bzip2 keeps up with the
+watch's link on one core and shrinks the sensor CSVs about 3.5 times and the audio about 1.5
+times.
+
+Usage: python archive.py ARCHIVE_DIR [ADDRESS] (lists the files and the space saved)
+'''
+
+import bz2
+from contextlib import closing
+from datetime import datetime
+import hashlib
+import os
+from os import path
+import recording_names
+import shutil
+import sqlite3
+import sys
+import tempfile
+from typing import BinaryIO
+
+_CATALOG_NAME = 'catalog.db'
+_OBJECTS_DIR_NAME = 'objects'
+_TEMP_DIR_NAME = 'temp'
+_OBJECT_SUFFIX = '.bz2'
+_COMPRESS_LEVEL = 9
+_TIMEOUT = 30 # s, to wait for another thread or process writing to the catalog
+_COPY_CHUNK_SIZE = 2**20
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    address TEXT NOT NULL,
+    name TEXT NOT NULL,
+    session TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES objects,
+    retrieved_at TEXT NOT NULL,
+    PRIMARY KEY (address, name)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_by_session ON files (session, address);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (hash);
+'''
+
+class Archive:
+    '''The archive in the directory at `dir_path`, which is made if missing.'''
+    
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        os.makedirs(path.join(dir_path, _OBJECTS_DIR_NAME), exist_ok=True)
+        os.makedirs(path.join(dir_path, _TEMP_DIR_NAME), exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.executescript(_SCHEMA)
+    
+    def open_writer(self, address: str, name: str) -> 'ArchiveWriter':
+        '''
+        Returns a writer that stores the file `name` of the watch at `address` from the bytes
+        written to it, in place of any file of that name stored before.
+        '''
+        return ArchiveWriter(self, address, name)
+    
+    def get(self, address: str, name: str) -> dict:
+        '''
+        Returns the 'hash', 'size', 'stored_size', 'session' and 'retrieved_at' of the file
+        `name` of the watch at `address`, or None if it is not stored.
+        '''
+        files = self.find(address, name=name)
+        return files[0] if files else None
+    
+    def find(self, address: str = None, session: str = None, name: str = None) -> list[dict]:
+        '''
+        Returns the files stored from the watch at `address`, of `session` and named `name`
+        (any if None), each as `get` describes it along with its 'address' and 'name', in
+        the order of the addresses and the names.
+        '''
+        conditions = ['1']
+        values = []
+        for column, value in (('address', address), ('session', session), ('name', name)):
+            if value is None: continue
+            conditions.append(f'{column} = ?')
+            values.append(value)
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                'SELECT address, name, session, files.hash, size, stored_size, retrieved_at '
+                'FROM files JOIN objects ON files.hash = objects.hash '
+                f'WHERE {" AND ".join(conditions)} ORDER BY address, name', values).fetchall()
+        keys = ('address', 'name', 'session', 'hash', 'size', 'stored_size', 'retrieved_at')
+        return [dict(zip(keys, x)) for x in rows]
+    
+    def has_intact(self, address: str, name: str, size: int = None) -> bool:
+        '''
+        Returns whether the file `name` of the watch at `address` is stored, with its
+        content on disk, and is `size` bytes long if given.
+        '''
+        file = self.get(address, name)
+        return bool(file and (size is None or file['size'] == size) and
+                    path.isfile(self._get_object_path(file['hash'])))
+    
+    def open(self, address: str, name: str) -> BinaryIO:
+        '''
+        Opens the file `name` of the watch at `address` for reading in binary, decompressing
+        as it is read.
+        '''
+        file = self.get(address, name)
+        if not file: raise FileNotFoundError(f'Not in the archive: {address}/{name}')
+        return bz2.open(self._get_object_path(file['hash']), 'rb')
+    
+    def extract(self, address: str, name: str, target_path: str):
+        '''Writes the file `name` of the watch at `address` out to `target_path`.'''
+        with self.open(address, name) as source, open(target_path + '.part', 'wb') as target:
+            shutil.copyfileobj(source, target, _COPY_CHUNK_SIZE)
+        os.replace(target_path + '.part', target_path)
+    
+    def remove(self, address: str, name: str):
+        '''
+        Forgets the file `name` of the watch at `address`, and deletes its content once no
+        other file has the same.
+        '''
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT hash FROM files WHERE address = ? AND name = ?',
+                             (address, name)).fetchone()
+            if not row: return
+            db.execute('DELETE FROM files WHERE address = ? AND name = ?', (address, name))
+            self._delete_if_unused(db, row[0])
+    
+    def get_stats(self) -> dict:
+        '''
+        Returns the number of 'files' stored and of distinct 'objects' they share, the
+        'bytes' of all files and the 'stored_bytes' that the objects take on disk.
+        '''
+        with closing(self._connect()) as db:
+            num_files, num_bytes = db.execute(
+                'SELECT COUNT(*), TOTAL(size) FROM files '
+                'JOIN objects ON files.hash = objects.hash').fetchone()
+            num_objects, num_stored_bytes = db.execute(
+                'SELECT COUNT(*), TOTAL(stored_size) FROM objects').fetchone()
+        return {
+            'files': num_files,
+            'objects': num_objects,
+            'bytes': int(num_bytes),
+            'stored_bytes': int(num_stored_bytes),
+        }
+    
+    def _add(self, address, name, temp_path, content_hash, size):
+        # Keeps the object unless the same content is stored already, then catalogs the file
+        object_path = self._get_object_path(content_hash)
+        if path.isfile(object_path): os.remove(temp_path)
+        else:
+            os.makedirs(path.dirname(object_path), exist_ok=True)
+            os.replace(temp_path, object_path)
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT hash FROM files WHERE address = ? AND name = ?',
+                             (address, name)).fetchone()
+            db.execute('INSERT OR IGNORE INTO objects VALUES (?, ?, ?)',
+                       (content_hash, size, path.getsize(object_path)))
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                       (address, name, recording_names.get_session_name(name),
+                        content_hash, datetime.now().isoformat(' ', 'seconds')))
+            if row and row[0] != content_hash: self._delete_if_unused(db, row[0])
+    
+    def _delete_if_unused(self, db, content_hash):
+        if db.execute('SELECT 1 FROM files WHERE hash = ?', (content_hash,)).fetchone(): return
+        db.execute('DELETE FROM objects WHERE hash = ?', (content_hash,))
+        object_path = self._get_object_path(content_hash)
+        if path.isfile(object_path): os.remove(object_path)
+    
+    def _get_object_path(self, content_hash):
+        # Spread over subdirectories so that no directory grows too large
+        return path.join(self.dir_path, _OBJECTS_DIR_NAME, content_hash[:2],
+                         content_hash[2:] + _OBJECT_SUFFIX)
+    
+    def _connect(self):
+        return sqlite3.connect(path.join(self.dir_path, _CATALOG_NAME), timeout=_TIMEOUT)
+
+class ArchiveWriter:
+    '''
+    Hashes and compresses the bytes of a file written to it into a temporary file in the
+    archive, which `commit` then stores. Bytes can be written across many attempts at
+    retrieving the file, but not across runs.
+    '''
+    
+    def __init__(self, archive: Archive, address: str, name: str):
+        self.archive = archive
+        self.address = address
+        self.name = name
+        self.num_bytes = 0
+        self._hash = hashlib.sha256()
+        self._compressor = bz2.BZ2Compressor(_COMPRESS_LEVEL)
+        temp_dir_path = path.join(archive.dir_path, _TEMP_DIR_NAME)
+        file, self._temp_path = tempfile.mkstemp(_OBJECT_SUFFIX, dir=temp_dir_path)
+        self._target = os.fdopen(file, 'wb')
+    
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self._target.write(self._compressor.compress(data))
+        self.num_bytes += len(data)
+    
+    def reset(self):
+        '''Throws away what was written so far, to write the file from the start.'''
+        self._target.seek(0)
+        self._target.truncate()
+        self.num_bytes = 0
+        self._hash = hashlib.sha256()
+        self._compressor = bz2.BZ2Compressor(_COMPRESS_LEVEL)
+    
+    def commit(self) -> str:
+        '''Stores the file as written so far and returns the hash of its content.'''
+        self._target.write(self._compressor.flush())
+        self._target.close()
+        content_hash = self._hash.hexdigest()
+        self.archive._add(self.address, self.name, self._temp_path, content_hash,
+                          self.num_bytes)
+        return content_hash
+    
+    def discard(self):
+        '''Throws away what was written.'''
+        self._target.close()
+        if path.isfile(self._temp_path): os.remove(self._temp_path)
+
+if __name__ == '__main__':
+    archive = Archive(sys.argv[1])
+    for file in archive.find(*sys.argv[2:3]):
+        print(f'{file["address"]:<16}{file["name"]:<32}{file["size"]:>14,}'
+              f'{file["stored_size"]:>14,}  {file["hash"][:12]}')
+    stats = archive.get_stats()
+    print(f'{stats["files"]:,} files in {stats["objects"]:,} objects, '
+          f'{stats["bytes"]:,} bytes stored in {stats["stored_bytes"]:,}')
@@ -0,0 +1,279 @@
+'''
+Frame-level audio features of recorded sessions, computed once and kept on disk.
+
+The features of a WAV are its RMS energy, its energy in frequency bands and its log-mel
+spectrogram, one row per frame of `frame_length` seconds every `hop` seconds. They are
+computed from the memory-mapped samples a block of frames at a time, so memory stays bounded
+however long the recording is, and are kept as memory-mapped arrays in a store at
+`store_dir_path` of at most `max_size` bytes.
+
+Usage: python audio_features.py [--workers N] [--frame-length S] [--hop S] [--mels N]
+                                SOURCE...
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import numpy
+from numpy.lib import format as npy_format
+from numpy.lib.stride_tricks import sliding_window_view
+import os
+from os import path
+import session
+import shutil
+import sys
+import tempfile
+import time
+
+store_dir_path = path.join(path.expanduser('~'), '.cache', 'wearable-ml', 'features')
+max_size = 2**32 # 4 GB
+
+_VERSION = 1
+_FRAME_LENGTH = .025 # s
+_HOP = .01 # s
+_NUM_MELS = 40
+_BAND_EDGES = (0, 250, 500, 1000, 2000, 4000, 8000) # Hz
+_BLOCK_NUM_FRAMES = 2**12
+'''Compute the features of x frames at a time, about 16 MB of spectra.'''
+_MIN_POWER = 1e-10
+'''Floor the power at x before taking its log, for frames of digital silence.'''
+_META_NAME = 'meta.json'
+
+class Features:
+    '''
+    The features of an audio in the store entry at `entry_path`: `rms` (frames), on the scale
+    where full scale is 1, and `bands` (frames, bands) and `log_mel` (frames, mels) in
+    decibels, as read-only, memory-mapped float32 arrays.
+    '''
+    
+    def __init__(self, entry_path: str):
+        self.entry_path = entry_path
+        with open(path.join(entry_path, _META_NAME)) as meta:
+            meta = json.load(meta)
+        self.settings: dict = meta['settings']
+        self.audio_rate: int = meta['audio_rate']
+        self.num_frames: int = meta['num_frames']
+        self._arrays: dict[str, numpy.ndarray] = {}
+    
+    @property
+    def rms(self) -> numpy.ndarray:
+        return self.get('rms')
+    
+    @property
+    def bands(self) -> numpy.ndarray:
+        return self.get('bands')
+    
+    @property
+    def log_mel(self) -> numpy.ndarray:
+        return self.get('log_mel')
+    
+    @property
+    def start_times(self) -> numpy.ndarray:
+        '''The seconds at which each frame starts in the audio.'''
+        return numpy.arange(self.num_frames) * self.settings['hop']
+    
+    def get(self, name: str) -> numpy.ndarray:
+        if name not in self._arrays:
+            self._arrays[name] = numpy.load(path.join(self.entry_path, name + '.npy'), 'r')
+        return self._arrays[name]
+
+def get_settings(frame_length: float = _FRAME_LENGTH, hop: float = _HOP,
+                 num_mels: int = _NUM_MELS, band_edges: tuple[float] = _BAND_EDGES) -> dict:
+    '''
+    Returns the settings that the features depend on: frames of `frame_length` seconds every
+    `hop` seconds, `num_mels` mel bands up to half the frame rate, and the energy bands
+    between each pair of `band_edges` in Hz (cut off at half the frame rate).
+    '''
+    return {
+        'frame_length': frame_length,
+        'hop': hop,
+        'num_mels': num_mels,
+        'band_edges': list(band_edges),
+    }
+
+def get_key(audio_path: str, settings: dict) -> str:
+    '''Returns the key of the features of the audio at `audio_path` with `settings`.'''
+    return _get_key(*session.map_wav(audio_path), settings)
+
+def extract(audio_path: str, settings: dict = None) -> Features:
+    '''
+    Returns the features of the WAV at `audio_path` with `settings` (by default, those of
+    `get_settings`), computing them into the store unless they are there already.
+    '''
+    return Features(_extract(audio_path, settings or get_settings()))
+
+def extract_all(source_paths: list[str], settings: dict = None,
+                num_workers: int = None) -> tuple[dict[str, Features], dict[str, Exception]]:
+    '''
+    Extracts the features of many WAVs like `extract`, on a pool of `num_workers` processes
+    (by default, one per core). `source_paths` may also name directories, of which all WAVs
+    are extracted. Returns the features of every audio and the error of every audio that
+    failed, both by its path.
+    '''
+    settings = settings or get_settings()
+    audio_paths = []
+    for source_path in source_paths:
+        if path.isdir(source_path):
+            audio_paths.extend(path.join(source_path, x)
+                               for x in sorted(os.listdir(source_path))
+                               if x.lower().endswith('.wav'))
+        else: audio_paths.append(source_path)
+    features = {}
+    errors = {}
+    with ProcessPoolExecutor(num_workers or os.cpu_count() or 1) as executor:
+        tasks = [(x, executor.submit(_extract, x, settings)) for x in audio_paths]
+        for audio_path, task in tasks:
+            try:
+                features[audio_path] = Features(task.result())
+            except Exception as ex:
+                errors[audio_path] = ex
+    return features, errors
+
+def compute(audio: numpy.ndarray, audio_rate: int, settings: dict,
+            targets: dict = None) -> dict[str, numpy.ndarray]:
+    '''
+    Computes the features of `audio`, an int16 array of (samples, channels) mixed down to
+    one channel, into `targets` (arrays of the right shapes by name, such as memory maps) or
+    new arrays, and returns them.
+    '''
+    frame_length, hop, num_frames = _get_frames(len(audio), audio_rate, settings)
+    fft_length = 1 << (frame_length - 1).bit_length()
+    band_matrix, mel_matrix = _get_matrices(audio_rate, fft_length, settings)
+    window = numpy.hanning(frame_length).astype(numpy.float32)
+    targets = targets or {
+        x: numpy.empty(y, numpy.float32)
+        for x, y in _get_shapes(len(audio), audio_rate, settings).items()
+    }
+    for start in range(0, num_frames, _BLOCK_NUM_FRAMES):
+        end = min(start + _BLOCK_NUM_FRAMES, num_frames)
+        # Only the samples of this block are read from the memory map
+        samples = audio[start * hop:(end - 1) * hop + frame_length]
+        samples = samples.mean(axis=1, dtype=numpy.float32) / 32768
+        frames = sliding_window_view(samples, frame_length)[::hop]
+        targets['rms'][start:end] = numpy.sqrt(numpy.mean(frames**2, axis=1))
+        power = numpy.abs(numpy.fft.rfft(frames * window, fft_length))**2
+        power = power.astype(numpy.float32)
+        targets['bands'][start:end] = 10 * numpy.log10(
+            numpy.maximum(power @ band_matrix, _MIN_POWER))
+        targets['log_mel'][start:end] = 10 * numpy.log10(
+            numpy.maximum(power @ mel_matrix, _MIN_POWER))
+    return targets
+
+def _extract(audio_path, settings):
+    # Returns the path of the entry
+    audio, audio_rate = session.map_wav(audio_path)
+    key = _get_key(audio, audio_rate, settings)
+    entry_path = path.join(store_dir_path, key)
+    if path.isfile(path.join(entry_path, _META_NAME)):
+        os.utime(path.join(entry_path, _META_NAME)) # mark as recently used
+        return entry_path
+    os.makedirs(store_dir_path, exist_ok=True)
+    # Written aside and renamed into place, which is also safe between processes
+    part_path = tempfile.mkdtemp('.part', key, store_dir_path)
+    try:
+        targets = {
+            x: npy_format.open_memmap(path.join(part_path, x + '.npy'), 'w+', numpy.float32, y)
+            for x, y in _get_shapes(len(audio), audio_rate, settings).items()
+        }
+        compute(audio, audio_rate, settings, targets)
+        for target in targets.values():
+            target.flush()
+        with open(path.join(part_path, _META_NAME), 'w') as meta:
+            json.dump(
+                {
+                    'version': _VERSION,
+                    'settings': settings,
+                    'audio_rate': audio_rate,
+                    'num_frames': len(targets['rms']),
+                    'source': path.abspath(audio_path),
+                }, meta)
+        try:
+            os.rename(part_path, entry_path)
+        except OSError: # another process got there first
+            if not path.isdir(entry_path): raise
+    finally:
+        shutil.rmtree(part_path, ignore_errors=True)
+    _evict()
+    return entry_path
+
+def _get_key(audio, audio_rate, settings):
+    # Only the samples and their rate, as nothing else in the WAV changes the features
+    digest = hashlib.sha256(audio)
+    digest.update(json.dumps({'version': _VERSION, 'audio_rate': audio_rate, **settings},
+                             sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def _get_frames(num_samples, audio_rate, settings):
+    # The samples per frame, between the starts of frames, and the number of frames
+    frame_length = round(settings['frame_length'] * audio_rate)
+    hop = round(settings['hop'] * audio_rate)
+    return frame_length, hop, max(0, (num_samples - frame_length) // hop + 1)
+
+def _get_shapes(num_samples, audio_rate, settings):
+    num_frames = _get_frames(num_samples, audio_rate, settings)[2]
+    num_bands = len([x for x in settings['band_edges'] if x < audio_rate / 2])
+    return {
+        'rms': (num_frames,),
+        'bands': (num_frames, num_bands),
+        'log_mel': (num_frames, settings['num_mels']),
+    }
+
+def _get_matrices(audio_rate, fft_length, settings):
+    # Sum the power of the FFT bins into the energy bands and into triangular mel bands
+    frequencies = numpy.fft.rfftfreq(fft_length, 1 / audio_rate)
+    edges = [x for x in settings['band_edges'] if x < audio_rate / 2] + [audio_rate / 2 + 1]
+    band_matrix = numpy.stack([(frequencies >= low) & (frequencies < high)
+                               for low, high in zip(edges, edges[1:])], axis=1)
+    to_mel = lambda x: 2595 * numpy.log10(1 + x / 700)
+    mel_points = numpy.linspace(0, to_mel(audio_rate / 2), settings['num_mels'] + 2)
+    hertz_points = 700 * (10**(mel_points / 2595) - 1)
+    mels = to_mel(frequencies)[:, None]
+    lows, middles, highs = mel_points[:-2], mel_points[1:-1], mel_points[2:]
+    mel_matrix = numpy.maximum(
+        0, numpy.minimum((mels - lows) / (middles - lows), (highs - mels) / (highs - middles)))
+    # Give each mel band the same total weight, however wide it is
+    mel_matrix *= 2 / (hertz_points[2:] - hertz_points[:-2])
+    return band_matrix.astype(numpy.float32), mel_matrix.astype(numpy.float32)
+
+def _evict():
+    entries = []
+    with os.scandir(store_dir_path) as scan:
+        for x in scan:
+            meta_path = path.join(x.path, _META_NAME)
+            if not x.is_dir() or not path.isfile(meta_path): continue
+            size = sum(y.stat().st_size for y in os.scandir(x.path))
+            entries.append((os.stat(meta_path).st_mtime, size, x.path))
+    size = sum(x[1] for x in entries)
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_size: break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        size -= entry_size
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(description='Extract audio features of recorded WAVs.')
+    parser.add_argument('sources', metavar='source', nargs='+',
+                        help='WAV audio, or directory of them, to extract the features of')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='number of audios to extract at once (default: one per core)')
+    parser.add_argument('-f', '--frame-length', default=_FRAME_LENGTH, type=float,
+                        help=f'seconds of audio per frame (default: {_FRAME_LENGTH})')
+    parser.add_argument('-p', '--hop', default=_HOP, type=float,
+                        help=f'seconds between the starts of frames (default: {_HOP})')
+    parser.add_argument('-m', '--mels', default=_NUM_MELS, type=int,
+                        help=f'number of mel bands (default: {_NUM_MELS})')
+    args = parser.parse_args(args)
+    start_time = time.monotonic()
+    features, errors = extract_all(args.sources,
+                                   get_settings(args.frame_length, args.hop, args.mels),
+                                   args.workers)
+    json.dump(
+        {
+            'features': {x: y.entry_path for x, y in features.items()},
+            'errors': {x: f'{type(y).__name__}: {y}' for x, y in errors.items()},
+            'seconds': time.monotonic() - start_time,
+        }, sys.stdout, indent=2)
+    print()
+    return 1 if errors else 0
+
+if __name__ == '__main__': sys.exit(main())
@@ -0,0 +1,154 @@
+'''
+Measures how fast the retriever lists, retrieves and deletes files.
+
+Runs `Retriever.get_files`, `Retriever.retrieve_files` and
+`Retriever.delete_files` against a `MockWatch` for every combination of file
+count and file size given, and reports files/s, MB/s, retries, timeouts and
+wall-clock time for each, so that changes to the download path show up as
+numbers. The network conditions of the mock watch can be set from the command
+line.
+
+Usage: python benchmark.py [--counts 1,10,40] [--sizes 64K,1M,8M] [--latency S]
+                           [--bandwidth B/S] [--drop-rate P] [--not-found-rate P]
+                           [--workers N] [--json PATH]
+'''
+
+import argparse
+import contextlib
+import json
+from mock_watch import MockWatch
+import os
+from os import path
+from retriever import Retriever
+import tempfile
+import time
+import transport
+
+_ADDRESS = '127.0.0.1'
+_UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+
+def run(file_count: int, file_size: int, **watch_options) -> list[dict]:
+    '''
+    Lists, retrieves and deletes `file_count` files of `file_size` bytes from a
+    `MockWatch` made with `watch_options`, and returns the measurements of each
+    operation.
+    '''
+    with tempfile.TemporaryDirectory() as record_dir_path, \
+            tempfile.TemporaryDirectory() as target_dir_path:
+        for i in range(file_count):
+            with open(path.join(record_dir_path, f'{i:04}.wav'), 'wb') as target:
+                target.write(os.urandom(file_size))
+        result = {}
+        
+        def on_done(message, *_):
+            result['message'] = message
+        
+        def on_got_files(message, files):
+            result['message'] = message
+            result['files'] = files
+        
+        def on_retrieving_files(message, _):
+            if message: result['message'] = message
+        
+        with MockWatch(record_dir_path, _ADDRESS, **watch_options):
+            # The message is left as None if the operation succeeds
+            results = [_measure('get_files', file_count, 0, result,
+                                lambda: Retriever.get_files(on_got_files, _ADDRESS))]
+            if results[0]['error']:
+                # Without the list of files there is nothing to retrieve or delete
+                return results + [
+                    _skip(x, file_count, results[0]['error'])
+                    for x in ('retrieve_files', 'delete_files')
+                ]
+            files = result.get('files', [])
+            return results + [
+                _measure('retrieve_files', file_count, file_count * file_size, result,
+                         lambda: Retriever.retrieve_files(files, target_dir_path,
+                                                          on_retrieving_files, _ADDRESS)),
+                _measure('delete_files', file_count, 0, result,
+                         lambda: Retriever.delete_files(files, on_done, _ADDRESS)),
+            ]
+
+def _measure(operation, file_count, num_bytes, result, start):
+    stats = transport.get_stats(_ADDRESS)
+    result['message'] = None
+    start_time = time.monotonic()
+    start().join()
+    seconds = time.monotonic() - start_time
+    new_stats = transport.get_stats(_ADDRESS)
+    return {
+        'operation': operation,
+        'files': file_count,
+        'bytes': num_bytes,
+        'seconds': seconds,
+        'files_per_second': file_count / seconds,
+        'mb_per_second': num_bytes / 2**20 / seconds,
+        'retries': new_stats['retries'] - stats['retries'],
+        'timeouts': new_stats['timeouts'] - stats['timeouts'],
+        'error': result['message'],
+    }
+
+def _skip(operation, file_count, error):
+    return {
+        'operation': operation,
+        'files': file_count,
+        'bytes': 0,
+        'seconds': 0.,
+        'files_per_second': 0.,
+        'mb_per_second': 0.,
+        'retries': 0,
+        'timeouts': 0,
+        'error': f'Skipped: {error}',
+    }
+
+def _parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in _UNITS: return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the retriever on a mock watch.')
+    parser.add_argument('-c', '--counts', default='1,10,40',
+                        help='comma-separated numbers of files (default: 1,10,40)')
+    parser.add_argument('-s', '--sizes', default='64K,1M,8M',
+                        help='comma-separated file sizes in bytes, K or M (default: 64K,1M,8M)')
+    parser.add_argument('-l', '--latency', default=.02, type=float,
+                        help='delay before every response in seconds (default: .02)')
+    parser.add_argument('-b', '--bandwidth', default=0, type=int,
+                        help='maximum bytes sent per second (default: no cap)')
+    parser.add_argument('-d', '--drop-rate', default=0., type=float,
+                        help='chance of dropping a retrieve connection halfway')
+    parser.add_argument('-n', '--not-found-rate', default=0., type=float,
+                        help='chance of failing a request with a 404')
+    parser.add_argument('-w', '--workers', default=Retriever.num_workers, type=int,
+                        help=f'number of files to retrieve at once '
+                        f'(default: {Retriever.num_workers})')
+    parser.add_argument('-j', '--json', help='also write the results as JSON to this file')
+    args = parser.parse_args(args)
+    Retriever.num_workers = args.workers
+    watch_options = {
+        'latency': args.latency,
+        'bandwidth': args.bandwidth,
+        'drop_rate': args.drop_rate,
+        'not_found_rate': args.not_found_rate,
+        'seed': 0,
+    }
+    print(f'{"operation":<15}{"files":>7}{"size":>11}{"seconds":>10}{"files/s":>10}'
+          f'{"MB/s":>9}{"retries":>9}{"timeouts":>10}  error')
+    results = []
+    for file_count in map(int, args.counts.split(',')):
+        for file_size in map(_parse_size, args.sizes.split(',')):
+            # The retriever logs every request, which would bury the results
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                cell_results = run(file_count, file_size, **watch_options)
+            for x in cell_results:
+                print(f'{x["operation"]:<15}{file_count:>7}{file_size:>11,}'
+                      f'{x["seconds"]:>10.3f}{x["files_per_second"]:>10.1f}'
+                      f'{x["mb_per_second"]:>9.2f}{x["retries"]:>9}{x["timeouts"]:>10}'
+                      f'  {x["error"] or ""}')
+                results.append(dict(x, file_size=file_size))
+    if args.json:
+        with open(args.json, 'w') as target:
+            json.dump(results, target, indent=2)
+
+if __name__ == '__main__': main()
@@ -0,0 +1,54 @@
+'''
+Finds the Tizen Sensors on a network.
+
+Every address in a CIDR range is probed concurrently with the watch server's
+`list` command. Hosts that do not exist or do not listen are given up on after
+a short connect timeout, so a /24 network is scanned in about a second.
+
+Usage: python discovery.py NETWORK (for example, 192.168.0.0/24)
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+import ipaddress
+import json
+import sys
+import transport
+
+_CONNECT_TIMEOUT = .5 # s
+_READ_TIMEOUT = 2 # s
+_NUM_WORKERS = 256
+
+def discover(network: str, connect_timeout: float = _CONNECT_TIMEOUT,
+             num_workers: int = _NUM_WORKERS) -> list[tuple[str, int]]:
+    '''
+    Probes every host in `network` (in CIDR notation, such as
+    '192.168.0.0/24') and returns the address and the number of files of each
+    watch that responded, in address order.
+    '''
+    hosts = tuple(map(str, ipaddress.ip_network(network, strict=False).hosts()))
+    with ThreadPoolExecutor(max(1, min(num_workers, len(hosts)))) as executor:
+        results = executor.map(lambda x: _probe(x, connect_timeout), hosts)
+        return [x for x in results if x]
+
+def _probe(address, connect_timeout):
+    connection = HTTPConnection(address, transport.PORT, timeout=connect_timeout)
+    try:
+        connection.connect()
+        # The watch may take a while to list its files once connected
+        connection.sock.settimeout(_READ_TIMEOUT)
+        # Always send a full request; the watch does not cope with connections that close
+        # without one
+        connection.request('GET', '/list')
+        response = connection.getresponse()
+        if response.status != 200: return None
+        file_names = response.read().decode('utf-8').strip().split('\n')
+        return address, sum(1 for x in file_names if x)
+    except (HTTPException, OSError, ValueError):
+        return None
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    json.dump(discover(sys.argv[1]), sys.stdout, indent=2)
+    print()
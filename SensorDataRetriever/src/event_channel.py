@@ -0,0 +1,70 @@
+'''
+Carries events from worker threads to a window's event loop.
+
+PySimpleGUI windows must only be updated from the thread that reads their
+events, so workers hand their results to an `EventChannel` instead of touching
+widgets. Progress is posted as often as it changes, but only the latest value
+of each kind is delivered, at most `rate` times per second, so a worker can
+report every chunk it reads without slowing down or flooding the window.
+'''
+
+from PySimpleGUI import Window
+from threading import Event, Lock, Thread
+import time
+
+_RATE = 15 # Hz
+
+class EventChannel:
+    '''
+    Delivers events to `window` as (key, value) through `Window.read`, where
+    the value is found in the values under the key.
+    '''
+    
+    def __init__(self, window: Window, rate: float = _RATE):
+        self.window = window
+        self.interval = 1 / rate
+        self._pending = {}
+        self._lock = Lock()
+        self._has_pending = Event()
+        self._is_closed = False
+        Thread(target=self._deliver_pending, daemon=True).start()
+    
+    def post(self, key: str, value=None):
+        '''
+        Queues an event to be delivered in the next round, replacing any event
+        of the same key still queued.
+        '''
+        with self._lock: self._pending[key] = value
+        self._has_pending.set()
+    
+    def send(self, key: str, value=None):
+        '''
+        Delivers an event right away, such as the result of a task, after the
+        other queued events and instead of any queued event of the same key,
+        which is out of date.
+        '''
+        with self._lock:
+            self._pending.pop(key, None)
+            if self._is_closed: return
+            self._write_pending()
+            self.window.write_event_value(key, value)
+    
+    def close(self):
+        '''Stops delivering events, such as when the window is closed.'''
+        with self._lock: self._is_closed = True
+        self._has_pending.set()
+    
+    def _deliver_pending(self):
+        while True:
+            self._has_pending.wait()
+            with self._lock:
+                if self._is_closed: return
+                self._has_pending.clear()
+                self._write_pending()
+            # Whatever is posted meanwhile waits for the next round
+            time.sleep(self.interval)
+    
+    def _write_pending(self):
+        for key, value in self._pending.items():
+            self.window.write_event_value(key, value)
+        self._pending.clear()
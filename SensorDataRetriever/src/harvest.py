@@ -0,0 +1,191 @@
+'''
+Retrieves data from a fleet of Tizen Sensors without a GUI.
+
+Every watch is harvested concurrently into its own subdirectory of the target
+directory (named after its address), using the same list/size/retrieve/delete
+protocol as the GUI. Files can optionally be deleted from a watch once they
+are verified on disk, and the sensor CSVs can be converted into `sensor_store`
+stores as soon as they are retrieved. A JSON summary of the bytes moved and the time taken per
+watch is printed to stdout when done; the log goes to stderr. The `metrics` of the run can be
+kept in a Prometheus text file and the events in a JSON lines file as it goes. With
+`--archive`, the target directory is an `archive.Archive` shared by all watches instead.
+
+Usage: python harvest.py [--delete] [--convert | --archive] [--jobs N] [--workers N]
+                         [--scan NETWORK] [--metrics PATH] [--events PATH]
+                         TARGET_DIR [ADDRESS...]
+'''
+
+from archive import Archive
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import discovery
+import json
+import metrics
+import os
+from os import path
+from retriever import Retriever
+import sensor_store
+import sys
+import time
+import transport
+
+def harvest(addresses: list[str], target_dir_path: str, should_delete=False,
+            should_convert=False, num_jobs=8) -> dict:
+    '''
+    Harvests the watches at `addresses` into `target_dir_path`, at most
+    `num_jobs` watches at a time, and returns a summary of the run.
+    '''
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max(1, num_jobs)) as executor:
+        devices = list(
+            executor.map(
+                lambda x: harvest_watch(x, target_dir_path, should_delete, should_convert),
+                addresses))
+    summary = {
+        'devices': devices,
+        'bytes_moved': sum(x['bytes_moved'] for x in devices),
+        'seconds': time.monotonic() - start_time,
+        'failed': [x['address'] for x in devices if x['error']],
+    }
+    if Retriever.should_archive: summary['archive'] = Archive(target_dir_path).get_stats()
+    return summary
+
+def harvest_watch(address: str, target_dir_path: str, should_delete=False,
+                  should_convert=False) -> dict:
+    '''
+    Retrieves every file from the watch at `address` into a subdirectory of
+    `target_dir_path`, deleting the verified files from the watch afterwards if
+    `should_delete` and converting the sensor CSVs if `should_convert`. Blocks
+    the thread and returns a summary of the harvest.
+    '''
+    summary = {
+        'address': address,
+        'files': 0,
+        'bytes_total': 0,
+        'bytes_moved': 0,
+        'bytes_per_second': 0.,
+        'deleted': 0,
+        'converted': 0,
+        'seconds': 0.,
+        'error': None,
+    }
+    start_time = time.monotonic()
+    # An archive keeps the files of every watch apart itself
+    watch_dir_path = (target_dir_path
+                      if Retriever.should_archive else path.join(target_dir_path, address))
+    os.makedirs(watch_dir_path, exist_ok=True)
+    result = {}
+    
+    def on_got_files(message, files):
+        result['message'] = message
+        result['files'] = tuple(x for x in files or () if x)
+    
+    def on_retrieving_files(message, _):
+        if message: result['message'] = message
+    
+    def on_deleted_files(message):
+        result['message'] = message
+    
+    with _timed_phase(address, 'list'):
+        Retriever.get_files(on_got_files, address).join()
+    files = result['files']
+    if not result['message']:
+        bytes_received = metrics.get_counter('retriever_received_bytes_total', address=address)
+        with _timed_phase(address, 'retrieve') as retrieve_phase:
+            Retriever.retrieve_files(files, watch_dir_path, on_retrieving_files, address).join()
+        summary['bytes_moved'] = int(
+            metrics.get_counter('retriever_received_bytes_total', address=address) -
+            bytes_received)
+        summary['bytes_per_second'] = summary['bytes_moved'] / (retrieve_phase['seconds'] or 1)
+    retrieved_files = Retriever.get_retrieved_files(watch_dir_path, address)
+    summary['files'] = len(retrieved_files)
+    if Retriever.should_archive:
+        archive = Archive(watch_dir_path)
+        summary['bytes_total'] = sum(archive.get(address, x)['size'] for x in retrieved_files)
+    else:
+        summary['bytes_total'] = sum(
+            path.getsize(path.join(watch_dir_path, x)) for x in retrieved_files)
+    if should_convert:
+        with _timed_phase(address, 'convert'):
+            for name in retrieved_files:
+                if name.lower().endswith('.csv'):
+                    sensor_store.convert(path.join(watch_dir_path, name))
+                    summary['converted'] += 1
+    # Only delete what is known to be intact on disk, even if some other file failed
+    files_to_delete = tuple(x for x in retrieved_files if x in files)
+    if should_delete and files_to_delete:
+        retrieve_message = result['message']
+        with _timed_phase(address, 'delete'):
+            Retriever.delete_files(files_to_delete, on_deleted_files, address).join()
+        if not result['message']: summary['deleted'] = len(files_to_delete)
+        result['message'] = retrieve_message or result['message']
+    summary['seconds'] = time.monotonic() - start_time
+    summary['error'] = result['message']
+    summary.update(transport.get_stats(address))
+    metrics.log('device', **summary)
+    return summary
+
+@contextlib.contextmanager
+def _timed_phase(address, phase):
+    # Yields a dict that holds the 'seconds' the phase took once it is over
+    timing = {'seconds': 0.}
+    start_time = time.monotonic()
+    try:
+        yield timing
+    finally:
+        timing['seconds'] = time.monotonic() - start_time
+        metrics.observe('harvest_phase_seconds', timing['seconds'], address=address,
+                        phase=phase)
+        metrics.log('phase', address=address, phase=phase,
+                    seconds=round(timing['seconds'], 4))
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(description='Retrieve data from a fleet of Tizen Sensors.')
+    parser.add_argument('target_dir', help='directory to store the data of each watch under')
+    parser.add_argument('addresses', metavar='address', nargs='*', help='address of a watch')
+    parser.add_argument('-d', '--delete', action='store_true',
+                        help='delete files from the watches once they are verified on disk')
+    store_group = parser.add_mutually_exclusive_group()
+    store_group.add_argument('-c', '--convert', action='store_true',
+                             help='convert the sensor CSVs into columnar stores once retrieved')
+    store_group.add_argument('-a', '--archive', action='store_true',
+                             help='store the files compressed and deduplicated in an archive '
+                             'at the target directory')
+    parser.add_argument('-j', '--jobs', default=8, type=int,
+                        help='number of watches to harvest at once (default: 8)')
+    parser.add_argument('-w', '--workers', default=Retriever.num_workers, type=int,
+                        help=f'number of files to retrieve at once per watch '
+                        f'(default: {Retriever.num_workers})')
+    parser.add_argument('-s', '--scan', metavar='NETWORK',
+                        help='also harvest every watch found in a network, such as '
+                        '192.168.0.0/24')
+    parser.add_argument('-m', '--metrics', metavar='PATH',
+                        help='keep the metrics in this file in the Prometheus text format')
+    parser.add_argument('-e', '--events', metavar='PATH',
+                        help='append every request, transfer and phase to this file as '
+                        'JSON lines')
+    args = parser.parse_args(args)
+    Retriever.num_workers = args.workers
+    Retriever.should_archive = args.archive
+    # Keep stdout clean for the summary
+    with contextlib.redirect_stdout(sys.stderr):
+        addresses = list(args.addresses)
+        if args.scan:
+            found = [address for address, _ in discovery.discover(args.scan)]
+            print('Found:', *found)
+            addresses += [x for x in found if x not in addresses]
+        if not addresses: parser.error('no watches to harvest')
+        if args.metrics: metrics.start_export(args.metrics)
+        if args.events: metrics.events_file = open(args.events, 'a')
+        try:
+            summary = harvest(addresses, args.target_dir, args.delete, args.convert, args.jobs)
+        finally:
+            metrics.stop_export()
+            if metrics.events_file: metrics.events_file.close()
+            metrics.events_file = None
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__': sys.exit(main())
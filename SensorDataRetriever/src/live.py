@@ -0,0 +1,228 @@
+'''
+Streams the sensor readings of Tizen Sensors while they record.
+
+`LiveClient` polls the `stream` command of every watch for the rows recorded
+since its last poll (the watch keeps the last minute of rows) and keeps each
+watch's rows in a `RingBuffer`: a fixed number of rows in NumPy arrays made up
+front, so memory stays the same however long the session runs. `RingBuffer.read`
+returns the latest seconds of readings, averaged down to a number of points for
+plotting, and `LiveClient.get_status` names the channels that have stopped
+changing, so that a dead sensor is noticed as soon as it happens rather than
+after the recording.
+
+Usage: python live.py ADDRESS... (prints the status of each watch every second)
+'''
+
+import json
+import math
+import numpy
+import sensor_store
+import sys
+from threading import Event, Lock, Thread
+import time
+import transport
+
+_CAPACITY = 20 * 60 * 10 # rows, 10 minutes at the watch's 20 Hz
+_POLL_INTERVAL = .25 # s
+_DEAD_AFTER = 10 # s
+'''Take a channel to be dead if it has not changed in x seconds.'''
+_STILL_CHANNELS = ('longitude', 'latitude')
+'''Channels that stay the same while the wearer stays put, so never dead.'''
+_RESYNC_AFTER = 2 # s
+'''
+Ask for all the rows the watch has if none have come in x seconds, in case it
+has started a new recording, which starts over from 0 seconds.
+'''
+_MAX_BACKOFF_ATTEMPT = 4
+
+class RingBuffer:
+    '''
+    The latest `capacity` rows of readings of `channels` (not counting the
+    `seconds` of each row), oldest rows overwritten first.
+    '''
+    
+    def __init__(self, channels: tuple[str], capacity: int = _CAPACITY):
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        self._seconds = numpy.empty(capacity)
+        self._values = numpy.empty((capacity, len(self.channels)))
+        self._num_rows = 0 # ever appended
+        self._lock = Lock()
+    
+    def __len__(self):
+        return min(self._num_rows, self.capacity)
+    
+    @property
+    def last_seconds(self) -> float:
+        '''The seconds of the newest row, or -1 if there are no rows.'''
+        with self._lock:
+            if not self._num_rows: return -1.
+            return float(self._seconds[(self._num_rows - 1) % self.capacity])
+    
+    def append(self, seconds: numpy.ndarray, values: numpy.ndarray):
+        '''Adds rows of `seconds` and `values` (rows, channels), in time order.'''
+        seconds = seconds[-self.capacity:]
+        values = values[-self.capacity:]
+        with self._lock:
+            start = self._num_rows % self.capacity
+            # Fill to the end of the arrays, then wrap around to the start
+            count = min(len(seconds), self.capacity - start)
+            self._seconds[start:start + count] = seconds[:count]
+            self._values[start:start + count] = values[:count]
+            self._seconds[:len(seconds) - count] = seconds[count:]
+            self._values[:len(seconds) - count] = values[count:]
+            self._num_rows += len(seconds)
+    
+    def get(self, duration: float = math.inf) -> tuple[numpy.ndarray, numpy.ndarray]:
+        '''
+        Returns copies of the `seconds` and `values` of the rows in the last
+        `duration` seconds, oldest first.
+        '''
+        with self._lock:
+            num_rows = len(self)
+            end = self._num_rows % self.capacity
+            order = numpy.arange(end - num_rows, end) % self.capacity
+            seconds = self._seconds[order]
+            values = self._values[order]
+        if num_rows and duration < math.inf:
+            start = numpy.searchsorted(seconds, seconds[-1] - duration, 'right')
+            seconds, values = seconds[start:], values[start:]
+        return seconds, values
+    
+    def read(self, duration: float,
+             num_points: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        '''
+        Returns the readings of the last `duration` seconds averaged into
+        `num_points` equal spans of time, as the middle `seconds` of each span
+        and the mean `values` (points, channels), with NaN for spans without
+        rows.
+        '''
+        seconds, values = self.get(duration)
+        if not len(seconds):
+            return numpy.empty(0), numpy.empty((0, len(self.channels)))
+        edges = numpy.linspace(seconds[-1] - duration, seconds[-1], num_points + 1)
+        # The last span also takes the newest row, at its very end
+        starts = numpy.searchsorted(seconds, edges[:-1])
+        counts = numpy.diff(numpy.append(starts, len(seconds)))
+        sums = numpy.add.reduceat(values, numpy.minimum(starts, len(seconds) - 1))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = numpy.where(counts[:, None] > 0, sums / counts[:, None], numpy.nan)
+        return (edges[:-1] + edges[1:]) / 2, means
+    
+    def find_dead_channels(self, duration: float = _DEAD_AFTER) -> list[str]:
+        '''
+        Returns the channels that have not changed in the last `duration`
+        seconds, apart from location, or none if the rows don't go back that
+        far yet.
+        '''
+        seconds, values = self.get(duration)
+        if not len(seconds) or self.last_seconds - seconds[0] < duration * .9: return []
+        is_flat = numpy.all((values == values[0]) | numpy.isnan(values), axis=0)
+        return [x for x, y in zip(self.channels, is_flat) if y and x not in _STILL_CHANNELS]
+
+class LiveClient:
+    '''
+    Streams the readings of the watches at `addresses` into a `RingBuffer` of
+    `capacity` rows each in `buffers`, polling every `interval` seconds from a
+    thread per watch.
+    '''
+    
+    def __init__(self, addresses: list[str], capacity: int = _CAPACITY,
+                 interval: float = _POLL_INTERVAL):
+        self.addresses = tuple(addresses)
+        self.capacity = capacity
+        self.interval = interval
+        self.buffers: dict[str, RingBuffer] = {}
+        self._errors: dict[str, str] = {}
+        self._receive_times: dict[str, float] = {}
+        self._should_stop = Event()
+        self._threads: list[Thread] = []
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *_):
+        self.stop()
+    
+    def start(self):
+        self._should_stop.clear()
+        self._threads = [
+            Thread(target=self._poll, args=(x,), daemon=True) for x in self.addresses
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        self._should_stop.set()
+        for thread in self._threads:
+            thread.join()
+    
+    def get_status(self, dead_after: float = _DEAD_AFTER) -> dict[str, dict]:
+        '''
+        Returns, by address, the number of 'rows' held, the 'seconds' of the
+        newest row, how many seconds ago a row last arrived ('silent_for', None
+        if never), the 'dead_channels' and the 'error' of the last poll.
+        '''
+        status = {}
+        now = time.monotonic()
+        for address in self.addresses:
+            buffer = self.buffers.get(address)
+            receive_time = self._receive_times.get(address)
+            status[address] = {
+                'rows': len(buffer) if buffer else 0,
+                'seconds': buffer.last_seconds if buffer else None,
+                'silent_for': now - receive_time if receive_time else None,
+                'dead_channels': buffer.find_dead_channels(dead_after) if buffer else [],
+                'error': self._errors.get(address),
+            }
+        return status
+    
+    def _poll(self, address):
+        attempt = 0
+        while not self._should_stop.is_set():
+            start_time = time.monotonic()
+            buffer = self.buffers.get(address)
+            since = -1
+            receive_time = self._receive_times.get(address, -math.inf)
+            if buffer and start_time - receive_time < _RESYNC_AFTER:
+                since = buffer.last_seconds
+            try:
+                transport.back_off(address, min(attempt, _MAX_BACKOFF_ATTEMPT))
+                with transport.request(address, 'stream', repr(since),
+                                       should_log=False) as response:
+                    lines = response.read().decode('utf-8').splitlines()
+                self._receive(address, lines)
+                self._errors.pop(address, None)
+                attempt = 0
+            except Exception as ex:
+                transport.record_failure(address, ex)
+                self._errors[address] = str(ex)
+                attempt += 1
+            self._should_stop.wait(max(0, self.interval - (time.monotonic() - start_time)))
+    
+    def _receive(self, address, lines):
+        if not lines: return
+        channels = tuple(lines[0].strip().split(','))
+        buffer = self.buffers.get(address)
+        if not buffer or buffer.channels != channels[1:]:
+            buffer = self.buffers[address] = RingBuffer(channels[1:], self.capacity)
+        if len(lines) == 1: return # no new rows
+        rows = sensor_store.parse_rows(lines[1:], len(channels))
+        if len(rows) and rows[-1, 0] < buffer.last_seconds:
+            # A new recording
+            buffer = self.buffers[address] = RingBuffer(channels[1:], self.capacity)
+        rows = rows[rows[:, 0] > buffer.last_seconds]
+        if len(rows):
+            buffer.append(rows[:, 0], rows[:, 1:])
+            self._receive_times[address] = time.monotonic()
+
+if __name__ == '__main__':
+    with LiveClient(sys.argv[1:]) as client:
+        try:
+            while True:
+                time.sleep(1)
+                json.dump(client.get_status(), sys.stdout)
+                print()
+        except KeyboardInterrupt:
+            pass
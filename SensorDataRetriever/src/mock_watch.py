@@ -0,0 +1,189 @@
+'''
+A stand-in for the Tizen Sensor's server that runs on this computer.
+
+Serves the same `list`, `size`, `retrieve` and `delete` commands as the watch
+(see `Server.Execute` in TizenSensor) from a local directory, and can inject
+latency, a bandwidth cap, dropped connections and 404 responses so that the
+retriever can be exercised and benchmarked without a watch. The `stream`
+command serves made-up readings of a recording that starts with the server,
+some of whose channels can be made dead (stuck at 0).
+
+Usage: python mock_watch.py [--address ADDRESS] [--latency S] [--bandwidth B/S]
+                            [--drop-rate P] [--not-found-rate P]
+                            [--dead-channels NAMES] RECORD_DIR
+'''
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy
+import os
+from os import path
+import random
+import sensor_store
+from threading import Lock, Thread
+import time
+import transport
+
+_STREAM_RATE = 20 # Hz, the rate at which the watch makes rows
+_STREAM_HISTORY = 60 # s, of rows kept by the watch
+
+class MockWatch:
+    '''
+    Serves the files in `record_dir_path` at `address` on the watch's port.
+    
+    `latency` is the delay in seconds before every response, `bandwidth` caps
+    the bytes sent per second across all connections (0 for no cap), and `drop_rate` and
+    `not_found_rate` are the chances of a `retrieve` connection being dropped
+    halfway and of any request failing with a 404, respectively. The
+    `dead_channels` of the stream never change from 0.
+    '''
+    
+    def __init__(self, record_dir_path: str, address='127.0.0.1', latency=0., bandwidth=0,
+                 drop_rate=0., not_found_rate=0., seed: int = None,
+                 dead_channels: tuple[str] = ()):
+        self.record_dir_path = record_dir_path
+        self.address = address
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.not_found_rate = not_found_rate
+        self.dead_channels = tuple(dead_channels)
+        self.counts = {'requests': 0, 'drops': 0, 'not_found': 0}
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._link_free_time = 0.
+        self._start_time = time.monotonic()
+        self._server: ThreadingHTTPServer = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *_):
+        self.stop()
+    
+    def start(self):
+        '''Starts serving on a background thread.'''
+        self._server = ThreadingHTTPServer((self.address, transport.PORT), _Handler)
+        self._server.daemon_threads = True
+        self._server.watch = self
+        self._start_time = time.monotonic()
+        Thread(target=self._server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def _roll(self, chance):
+        with self._lock: return self._random.random() < chance
+    
+    def _count(self, key):
+        with self._lock: self.counts[key] += 1
+    
+    def _wait_for_link(self, num_bytes):
+        # Connections share the bandwidth, so each chunk waits for the ones queued before it
+        with self._lock:
+            now = time.monotonic()
+            self._link_free_time = max(self._link_free_time, now) + num_bytes / self.bandwidth
+            delay = self._link_free_time - now
+        time.sleep(delay)
+    
+    def _get_stream(self, since):
+        # Rows at every tick after `since`, as far back as the watch keeps them
+        now = time.monotonic() - self._start_time
+        first_tick = int(max(since, now - _STREAM_HISTORY) * _STREAM_RATE) + 1
+        seconds = numpy.arange(max(0, first_tick), int(now * _STREAM_RATE) + 1) / _STREAM_RATE
+        channels = tuple(sensor_store.CHANNEL_DTYPES)
+        rows = numpy.empty((len(seconds), len(channels)))
+        rows[:, 0] = seconds
+        for i, channel in enumerate(channels[1:], 1):
+            if channel in self.dead_channels: rows[:, i] = 0
+            elif channel == 'heartRate':
+                rows[:, i] = 75 + numpy.round(8 * numpy.sin(seconds / 9))
+            elif channel == 'longitude': rows[:, i] = -111.84
+            elif channel == 'latitude': rows[:, i] = 40.76
+            else: rows[:, i] = numpy.sin(seconds * (2+i)) + .1 * numpy.cos(seconds * 37 * i)
+        lines = [','.join(channels)] + [','.join(map(repr, x)) for x in rows.tolist()]
+        return '\n'.join(lines).encode('utf-8')
+
+class _Handler(BaseHTTPRequestHandler):
+    # Like the watch, respond without a Content-Length and close the connection
+    protocol_version = 'HTTP/1.0'
+    
+    def do_GET(self):
+        watch: MockWatch = self.server.watch
+        watch._count('requests')
+        if watch.latency: time.sleep(watch.latency)
+        request = self.path[1:].split(':')
+        command = request[0]
+        args = request[1].split(',') if len(request) == 2 else []
+        try:
+            if watch._roll(watch.not_found_rate):
+                watch._count('not_found')
+                raise Exception('Injected failure')
+            content = self._execute(watch, command, args)
+        except Exception as ex:
+            self._send(watch, 404, str(ex).encode('utf-8'))
+            return
+        should_drop = command == 'retrieve' and watch._roll(watch.drop_rate)
+        if should_drop: watch._count('drops')
+        self._send(watch, 200, content, should_drop)
+    
+    def log_message(self, *_):
+        pass
+    
+    def _execute(self, watch, command, args):
+        if command == 'list':
+            return '\n'.join(sorted(os.listdir(watch.record_dir_path))).encode('utf-8')
+        if command == 'size':
+            return str(path.getsize(path.join(watch.record_dir_path, args[0]))).encode('utf-8')
+        if command == 'retrieve':
+            with open(path.join(watch.record_dir_path, args[0]), 'rb') as source:
+                content = source.read()
+            return content[int(args[1]):] if len(args) == 2 else content
+        if command == 'delete':
+            os.remove(path.join(watch.record_dir_path, args[0]))
+            return b'1'
+        if command == 'stream':
+            return watch._get_stream(float(args[0]) if args else -1)
+        raise Exception('Unknown command: ' + command)
+    
+    def _send(self, watch, status, content, should_drop=False):
+        self.send_response_only(status)
+        self.send_header('Connection', 'close')
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.end_headers()
+        if should_drop: content = content[:len(content) // 2]
+        chunk_size = max(2**12, watch.bandwidth // 20) if watch.bandwidth else len(content) or 1
+        for i in range(0, len(content), chunk_size):
+            chunk = content[i:i + chunk_size]
+            if watch.bandwidth: watch._wait_for_link(len(chunk))
+            self.wfile.write(chunk)
+        self.close_connection = True
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(description='Serve a directory like a Tizen Sensor.')
+    parser.add_argument('record_dir', help='directory of files to serve')
+    parser.add_argument('-a', '--address', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-l', '--latency', default=0., type=float,
+                        help='delay before every response in seconds')
+    parser.add_argument('-b', '--bandwidth', default=0, type=int,
+                        help='maximum bytes sent per second (default: no cap)')
+    parser.add_argument('-d', '--drop-rate', default=0., type=float,
+                        help='chance of dropping a retrieve connection halfway')
+    parser.add_argument('-n', '--not-found-rate', default=0., type=float,
+                        help='chance of failing a request with a 404')
+    parser.add_argument('-D', '--dead-channels', default='',
+                        help='comma-separated channels to stream as dead, such as heartRate')
+    args = parser.parse_args(args)
+    watch = MockWatch(args.record_dir, args.address, args.latency, args.bandwidth,
+                      args.drop_rate, args.not_found_rate,
+                      dead_channels=tuple(x for x in args.dead_channels.split(',') if x))
+    watch.start()
+    print(f'Serving {args.record_dir} at {args.address}:{transport.PORT}')
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        watch.stop()
+
+if __name__ == '__main__': main()
@@ -0,0 +1,22 @@
+'''
+Names of the files that a Tizen Sensor records.
+
+The watch names the files of a recording after the time it started, such as
+`21-07-05-15-27-00-Audio.wav` and `21-07-05-15-27-00-Sensor.csv`. Kept apart
+from `session` so that the retriever can group files without loading NumPy.
+'''
+
+from os import path
+
+_FILE_SUFFIXES = ('-Audio', '-Sensor')
+
+def get_session_name(file_name: str) -> str:
+    '''
+    Returns the name that the files of a recording share, the name of the file
+    `file_name` without its extension and the `-Audio` or `-Sensor` the watch
+    puts after the time.
+    '''
+    stem = path.splitext(file_name)[0]
+    for suffix in _FILE_SUFFIXES:
+        if stem.endswith(suffix): return stem[:-len(suffix)]
+    return stem
@@ -0,0 +1,195 @@
+'''
+Resamples sensor readings onto a uniform time grid and aligns them with audio.
+
+The sensors of a Tizen Sensor fire at their own irregular times, and a channel
+of the recorded CSV has no reading (NaN) in rows where its sensor did not fire.
+`Resampler` takes the readings in chunks and turns every channel into values on
+a grid of `rate` points per second, either interpolating linearly between
+readings or holding the previous reading, using vectorized NumPy throughout.
+It only keeps the few readings still needed for the grid points to come, so a
+multi-hour session is processed in constant memory.
+
+`align_with_audio` runs a session's sensor readings through a `Resampler` and
+pairs every block of grid points with the audio samples of the same session
+that they span, so that the grid can be lined up with audio samples or frames.
+'''
+
+from collections.abc import Iterator
+import itertools
+import math
+import numpy
+from os import path
+import sensor_store
+import wave
+
+LINEAR = 'linear'
+PREVIOUS = 'previous'
+DEFAULT_METHODS = {
+    'heartRate': PREVIOUS,
+    'longitude': PREVIOUS,
+    'latitude': PREVIOUS,
+}
+'''Channels to hold instead of interpolating; other channels are interpolated linearly.'''
+
+_MAX_LAG = 5 # s
+'''
+Give up waiting for the next reading of a linearly interpolated channel after
+this long and hold its last reading instead, so that a dead sensor does not
+make the readings of the others pile up.
+'''
+_BLOCK_SECONDS = 60
+
+class Resampler:
+    '''
+    Resamples `channels` onto the grid `start_time + k / rate` (k = 0, 1, ...),
+    holding each channel named in `methods` (by default, `DEFAULT_METHODS`) with
+    `PREVIOUS` and interpolating the others with `LINEAR`. Grid points before
+    the first reading of a channel are NaN.
+    '''
+    
+    def __init__(self, channels: tuple[str], rate: float, start_time: float = 0.,
+                 methods: dict[str, str] = None, max_lag: float = _MAX_LAG):
+        methods = DEFAULT_METHODS if methods is None else methods
+        self.channels = tuple(channels)
+        self.rate = rate
+        self.start_time = start_time
+        self.methods = {x: methods.get(x, LINEAR) for x in self.channels}
+        self.max_lag = max_lag
+        self._times = {x: numpy.empty(0) for x in self.channels}
+        self._values = {x: numpy.empty(0) for x in self.channels}
+        self._next_index = 0
+        self._end_time = -math.inf
+    
+    def push(self, seconds: numpy.ndarray,
+             columns: dict[str, numpy.ndarray]) -> tuple[numpy.ndarray, dict]:
+        '''
+        Adds a chunk of rows recorded at `seconds` (ascending, and after every
+        earlier chunk), and returns the grid points that are now settled along
+        with the value of every channel at them.
+        '''
+        if len(seconds) == 0: return self._emit(-math.inf)
+        seconds = numpy.asarray(seconds, numpy.float64)
+        for channel in self.channels:
+            values = numpy.asarray(columns[channel], numpy.float64)
+            is_valid = ~numpy.isnan(values)
+            self._times[channel] = numpy.concatenate((self._times[channel], seconds[is_valid]))
+            self._values[channel] = numpy.concatenate((self._values[channel], values[is_valid]))
+        self._end_time = seconds[-1]
+        # A grid point is settled once every linear channel has a reading at or after it
+        settled_time = self._end_time
+        for channel, method in self.methods.items():
+            if method != LINEAR: continue
+            times = self._times[channel]
+            last_time = times[-1] if len(times) else -math.inf
+            settled_time = min(settled_time, max(last_time, self._end_time - self.max_lag))
+        return self._emit(settled_time)
+    
+    def flush(self) -> tuple[numpy.ndarray, dict]:
+        '''Returns the remaining grid points up to the last row pushed.'''
+        return self._emit(self._end_time)
+    
+    def _emit(self, until_time):
+        end_index = self._next_index
+        if until_time != -math.inf:
+            end_index = max(end_index,
+                            math.floor((until_time - self.start_time) * self.rate) + 1)
+        grid = self.start_time + numpy.arange(self._next_index, end_index) / self.rate
+        self._next_index = end_index
+        result = {}
+        for channel in self.channels:
+            times = self._times[channel]
+            values = self._values[channel]
+            if len(times) == 0:
+                result[channel] = numpy.full(len(grid), numpy.nan)
+                continue
+            if self.methods[channel] == LINEAR:
+                result[channel] = numpy.interp(grid, times, values, left=numpy.nan)
+            else:
+                indices = numpy.searchsorted(times, grid, side='right') - 1
+                result[channel] = numpy.where(indices >= 0, values[indices], numpy.nan)
+            if len(grid):
+                # Only the last reading before the next grid point is needed from now on
+                keep_index = max(0, numpy.searchsorted(times, grid[-1], side='right') - 1)
+                self._times[channel] = times[keep_index:]
+                self._values[channel] = values[keep_index:]
+        return grid, result
+
+def iter_sensor_blocks(sensor_path: str, block_num_rows: int, channels: tuple[str] = None):
+    '''
+    Iterates over the readings of a session, `block_num_rows` rows at a time,
+    as dicts of float64 arrays with NaN where a reading is missing. The
+    `sensor_path` is either a CSV or a store made from it by `sensor_store`.
+    '''
+    if path.isdir(sensor_path):
+        store = sensor_store.SensorStore(sensor_path)
+        for block in store.iter_blocks(block_num_rows, channels=channels):
+            yield {x: _to_float(column) for x, column in block.items()}
+    else:
+        csv_channels, blocks = sensor_store.read_csv_blocks(sensor_path, block_num_rows)
+        for block in blocks:
+            yield {x: block[:, csv_channels.index(x)] for x in channels or csv_channels}
+
+def align_with_audio(sensor_path: str, audio_path: str, rate: float,
+                     channels: tuple[str] = None, audio_offset: float = 0.,
+                     block_seconds: float = _BLOCK_SECONDS,
+                     methods: dict[str, str] = None) -> Iterator[dict[str, numpy.ndarray]]:
+    '''
+    Resamples the sensor readings at `sensor_path` (a CSV or a store) to `rate`
+    points per second and pairs them with the 16-bit WAV at `audio_path`,
+    about `block_seconds` of recording at a time.
+    
+    Yields dicts with the grid times in 'seconds', one array per channel,
+    'sample_index' (the audio sample at each grid point, which may fall outside
+    the audio) and 'audio' (the samples from the first grid point of the block
+    up to the first of the next, as int16 with one column per audio channel).
+    `audio_offset` is how many seconds after the sensors the audio started. To
+    line the grid up with audio frames of `hop` samples, use
+    `rate = audio rate / hop`.
+    '''
+    with wave.open(audio_path, 'rb') as audio:
+        if audio.getsampwidth() != 2: raise ValueError('Only 16-bit audio is supported')
+        audio_rate = audio.getframerate()
+        num_audio_channels = audio.getnchannels()
+        num_frames = audio.getnframes()
+        block_num_rows = max(1, int(block_seconds * 20)) # the watch writes rows at 20 Hz
+        if channels: channels = ('seconds', *(x for x in channels if x != 'seconds'))
+        blocks = iter_sensor_blocks(sensor_path, block_num_rows, channels)
+        resampler = None
+        next_sample_index = None
+        for block in itertools.chain(blocks, (None,)):
+            if block is not None:
+                if resampler is None:
+                    resampler = Resampler(tuple(x for x in block if x != 'seconds'), rate,
+                                          methods=methods)
+                grid, values = resampler.push(block['seconds'], block)
+            elif resampler is None: return
+            else: grid, values = resampler.flush()
+            if len(grid) == 0: continue
+            sample_indices = get_sample_indices(grid - audio_offset, audio_rate)
+            if next_sample_index is None:
+                next_sample_index = min(max(0, sample_indices[0]), num_frames)
+                audio.setpos(next_sample_index)
+            end_sample_index = min(
+                max(0, get_sample_indices(grid[-1] + 1 / rate - audio_offset, audio_rate)),
+                num_frames)
+            samples = numpy.frombuffer(
+                audio.readframes(max(0, end_sample_index - next_sample_index)), '<i2')
+            next_sample_index = max(next_sample_index, end_sample_index)
+            yield {
+                'seconds': grid,
+                **values,
+                'sample_index': sample_indices,
+                'audio': samples.reshape(-1, num_audio_channels),
+            }
+
+def get_sample_indices(seconds: numpy.ndarray, audio_rate: int) -> numpy.ndarray:
+    '''Returns the index of the audio sample at each time.'''
+    return numpy.round(numpy.asarray(seconds) * audio_rate).astype(numpy.int64)
+
+def get_frame_indices(seconds: numpy.ndarray, audio_rate: int, hop: int) -> numpy.ndarray:
+    '''Returns the index of the audio frame of `hop` samples at each time.'''
+    return get_sample_indices(seconds, audio_rate) // hop
+
+def _to_float(column):
+    if column.dtype.kind != 'i': return column.astype(numpy.float64)
+    return numpy.where(column == sensor_store.MISSING_INT, numpy.nan, column)
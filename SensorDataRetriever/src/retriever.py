@@ -0,0 +1,280 @@
+'''
+Talks to a Tizen Sensor to list, retrieve and delete its recorded files.
+
+Every operation runs on a background thread, which is also returned so that
+callers without an event loop (such as `harvest`) can wait for it, and reports
+back through a callback. The speed of every file transfer and the time spent
+writing it to disk are recorded in `metrics`. With `Retriever.should_archive`,
+files are stored compressed into an `archive.Archive` instead of as they are.
+
+Project WISE -- Wearable-ML
+Qianlang Chen
+F 07/02/21
+'''
+
+from archive import Archive
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from http.client import HTTPResponse
+import json
+import math
+import metrics
+import os
+from os import path
+from threading import Event, Lock, Thread
+import time
+import transport
+
+class Retriever:
+    _CONNECTION_FAILED_MESSAGE = 'Connection failed!'
+    _MAX_NUM_ATTEMPTS = 6
+    _MANIFEST_NAME = '.manifest.json'
+    _PART_SUFFIX = '.part'
+    
+    address: str = None
+    num_workers = 4 # files to probe and transfer at once
+    should_sync = True # skip retrieved files and resume partial ones
+    should_archive = False # store into an archive at the target directory
+    
+    def get_files(on_got_files: Callable[[str, tuple[str]], None],
+                  address: str = None) -> Thread:
+        address = address or Retriever.address
+        
+        def f():
+            for attempt in range(Retriever._MAX_NUM_ATTEMPTS):
+                transport.back_off(address, attempt)
+                try:
+                    response = Retriever._request(address, 'list')
+                    file_names = response.read().decode('utf-8').strip().split('\n')
+                    on_got_files(None, tuple(sorted(file_names)))
+                    break
+                except Exception as ex: Retriever._handle_exception(address, ex)
+            else:
+                on_got_files(Retriever._CONNECTION_FAILED_MESSAGE, None)
+            print('Stats:', transport.get_stats(address))
+        
+        thread = Thread(target=f)
+        thread.start()
+        return thread
+    
+    def retrieve_files(file_names: tuple[str], target_dir_path: str,
+                       on_retrieving_files: Callable[[str, float], None],
+                       address: str = None) -> Thread:
+        address = address or Retriever.address
+        
+        def f():
+            total_bytes = bytes_loaded = max_bytes_loaded = 0
+            lock = Lock()
+            failed = Event()
+            archive = Archive(target_dir_path) if Retriever.should_archive else None
+            manifest = Retriever._load_manifest(target_dir_path)
+            records = manifest.setdefault(address, {})
+            
+            def get_size(name):
+                for attempt in range(Retriever._MAX_NUM_ATTEMPTS):
+                    if failed.is_set(): return 0
+                    transport.back_off(address, attempt)
+                    try:
+                        response = Retriever._request(address, 'size', name)
+                        return int(response.read().decode('utf-8'))
+                    except Exception as ex: Retriever._handle_exception(address, ex)
+                failed.set()
+                return 0
+            
+            def record(name, size, is_complete):
+                if archive: return # the archive keeps its own catalog
+                with lock:
+                    records[name] = {'size': size, 'complete': is_complete}
+                    Retriever._save_manifest(target_dir_path, manifest)
+            
+            def prepare(name, size):
+                # Returns the number of bytes to resume from, or None if already retrieved
+                if archive:
+                    # Archived files start over, as the state of the compressor is lost
+                    is_retrieved = archive.has_intact(address, name, size)
+                    return None if Retriever.should_sync and is_retrieved else 0
+                target_path = path.join(target_dir_path, name)
+                part_path = target_path + Retriever._PART_SUFFIX
+                if Retriever.should_sync:
+                    if path.isfile(target_path) and path.getsize(target_path) == size:
+                        record(name, size, True)
+                        return None
+                    entry = records.get(name)
+                    if (path.isfile(part_path) and entry and not entry['complete'] and
+                            entry['size'] == size and path.getsize(part_path) <= size):
+                        return path.getsize(part_path)
+                if path.isfile(part_path): os.remove(part_path)
+                return 0
+            
+            def retrieve(name, size, file_bytes_loaded):
+                nonlocal bytes_loaded, max_bytes_loaded
+                target_path = path.join(target_dir_path, name)
+                part_path = target_path + Retriever._PART_SUFFIX
+                record(name, size, False)
+                writer = archive and archive.open_writer(address, name)
+                for attempt in range(Retriever._MAX_NUM_ATTEMPTS):
+                    if failed.is_set(): break
+                    transport.back_off(address, attempt)
+                    start_time = time.monotonic()
+                    num_bytes_received = 0
+                    write_seconds = 0.
+                    is_complete = is_oversized = False
+                    try:
+                        # Ask the watch to skip whatever earlier attempts or runs already wrote
+                        offset = (file_bytes_loaded > 0) * (file_bytes_loaded,)
+                        response = Retriever._request(address, 'retrieve', name, *offset,
+                                                      expected_bytes=size - file_bytes_loaded)
+                        with (contextlib.nullcontext(writer) if writer else open(
+                                part_path, 'ab')) as target:
+                            while True:
+                                data = response.read(2**20)
+                                if not data: break
+                                num_bytes_received += len(data)
+                                if file_bytes_loaded + len(data) > size:
+                                    # Such as a watch that ignores the offset and sends the
+                                    # whole file again; no need to wait for the rest of it
+                                    is_oversized = True
+                                    raise Exception(f'Size mismatch: more than {size} bytes')
+                                write_start_time = time.monotonic()
+                                target.write(data)
+                                write_seconds += time.monotonic() - write_start_time
+                                file_bytes_loaded += len(data)
+                                with lock:
+                                    bytes_loaded += len(data)
+                                    if bytes_loaded > max_bytes_loaded:
+                                        max_bytes_loaded = bytes_loaded
+                                        on_retrieving_files(None,
+                                                            bytes_loaded / (total_bytes or 1))
+                        transport.record_transfer(address, num_bytes_received,
+                                                  time.monotonic() - start_time)
+                        if file_bytes_loaded != size:
+                            raise Exception(f'Size mismatch: {file_bytes_loaded} != {size}')
+                        if writer: writer.commit()
+                        else:
+                            os.replace(part_path, target_path)
+                            record(name, size, True)
+                        is_complete = True
+                        return
+                    except Exception as ex:
+                        Retriever._handle_exception(address, ex)
+                        if is_oversized:
+                            # The watch sent the whole file again (or the file has changed), so
+                            # the partial file cannot be trusted anymore
+                            if writer: writer.reset()
+                            else: os.remove(part_path)
+                            with lock:
+                                # Let the progress go back, or it stays put until the
+                                # retrieve catches up with where it was
+                                bytes_loaded -= file_bytes_loaded
+                                max_bytes_loaded = bytes_loaded
+                                on_retrieving_files(None, bytes_loaded / (total_bytes or 1))
+                            file_bytes_loaded = 0
+                    finally:
+                        if num_bytes_received:
+                            Retriever._record_transfer(address, name, num_bytes_received,
+                                                       time.monotonic() - start_time,
+                                                       write_seconds, is_complete)
+                else: failed.set()
+                if writer: writer.discard()
+            
+            # Both the size probes and the transfers run on a bounded pool of workers so the
+            # link is kept busy between round trips
+            with ThreadPoolExecutor(max(1, Retriever.num_workers)) as executor:
+                sizes = tuple(executor.map(get_size, file_names))
+                if failed.is_set():
+                    on_retrieving_files(Retriever._CONNECTION_FAILED_MESSAGE, math.nan)
+                    return
+                total_bytes = sum(sizes)
+                
+                pending = []
+                for name, size in zip(file_names, sizes):
+                    file_bytes_loaded = prepare(name, size)
+                    if file_bytes_loaded is None: bytes_loaded += size
+                    else:
+                        bytes_loaded += file_bytes_loaded
+                        pending.append((name, size, file_bytes_loaded))
+                max_bytes_loaded = bytes_loaded
+                on_retrieving_files(None, bytes_loaded / (total_bytes or 1))
+                tuple(executor.map(lambda args: retrieve(*args), pending))
+            
+            print('Stats:', transport.get_stats(address))
+            if failed.is_set():
+                on_retrieving_files(Retriever._CONNECTION_FAILED_MESSAGE, math.nan)
+                return
+            on_retrieving_files(None, 1.)
+        
+        thread = Thread(target=f)
+        thread.start()
+        return thread
+    
+    def delete_files(file_names: tuple[str], on_deleted_files: Callable[[str], None],
+                     address: str = None) -> Thread:
+        address = address or Retriever.address
+        
+        def f():
+            for name in file_names:
+                for attempt in range(Retriever._MAX_NUM_ATTEMPTS):
+                    transport.back_off(address, attempt)
+                    try:
+                        response = Retriever._request(address, 'delete', name)
+                        content = response.read()
+                        if content != b'1': raise Exception(f'Failed to delete: {content}')
+                        break
+                    except Exception as ex: Retriever._handle_exception(address, ex)
+                else:
+                    on_deleted_files(Retriever._CONNECTION_FAILED_MESSAGE)
+                    return
+            
+            on_deleted_files(None)
+        
+        thread = Thread(target=f)
+        thread.start()
+        return thread
+    
+    def get_retrieved_files(target_dir_path: str, address: str = None) -> tuple[str]:
+        # Names of the files that were completely retrieved and are still intact on disk
+        address = address or Retriever.address
+        if Retriever.should_archive:
+            archive = Archive(target_dir_path)
+            return tuple(x['name'] for x in archive.find(address)
+                         if archive.has_intact(address, x['name'], x['size']))
+        records = Retriever._load_manifest(target_dir_path).get(address, {})
+        return tuple(name for name, entry in sorted(records.items())
+                     if entry['complete'] and path.isfile(path.join(target_dir_path, name)) and
+                     path.getsize(path.join(target_dir_path, name)) == entry['size'])
+    
+    def _load_manifest(target_dir_path):
+        # Maps each watch address to the name, size and completion state of its files
+        try:
+            with open(path.join(target_dir_path, Retriever._MANIFEST_NAME)) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_manifest(target_dir_path, manifest):
+        manifest_path = path.join(target_dir_path, Retriever._MANIFEST_NAME)
+        with open(manifest_path + Retriever._PART_SUFFIX, 'w') as target:
+            json.dump(manifest, target, indent=2)
+        os.replace(manifest_path + Retriever._PART_SUFFIX, manifest_path)
+    
+    def _request(address, command, *args, expected_bytes=0) -> HTTPResponse:
+        return transport.request(address, command, *args, expected_bytes=expected_bytes)
+    
+    def _record_transfer(address, name, num_bytes, seconds, write_seconds, is_complete):
+        metrics.count('retriever_received_bytes_total', num_bytes, address=address)
+        metrics.count('retriever_transfer_seconds_total', seconds, address=address)
+        metrics.count('retriever_disk_write_seconds_total', write_seconds, address=address)
+        if is_complete: metrics.count('retriever_files_total', address=address)
+        if seconds > 0:
+            metrics.observe('retriever_file_bytes_per_second', num_bytes / seconds,
+                            metrics.BYTES_PER_SECOND_BUCKETS, address=address)
+        metrics.log('transfer', address=address, file=name, bytes=num_bytes,
+                    seconds=round(seconds, 4), write_seconds=round(write_seconds, 4),
+                    bytes_per_second=round(num_bytes / seconds) if seconds > 0 else None,
+                    complete=is_complete)
+    
+    def _handle_exception(address, ex):
+        print('Caught:', ex)
+        transport.record_failure(address, ex)
+        metrics.log('error', address=address, error=f'{type(ex).__name__}: {ex}')
@@ -0,0 +1,212 @@
+'''
+A compact, columnar store for the sensor readings recorded by a Tizen Sensor.
+
+The watch records sensor readings as CSV text (see `SensorRecorder.DataHeader`
+in TizenSensor), which is slow to parse again and again. `convert` streams
+such a CSV, a block of rows at a time, into one typed binary file per column
+next to a small JSON description, all in a directory named after the CSV with
+a `.sensors` extension. `SensorStore` memory-maps the columns so that a time
+range of one channel is found by a binary search over the `seconds` column and
+read without touching the rest of the data.
+
+Usage: python sensor_store.py PATH... (CSV files or directories of them)
+'''
+
+import io
+import json
+import numpy
+import os
+from os import path
+import shutil
+import sys
+
+STORE_EXTENSION = '.sensors'
+CHANNEL_DTYPES = {
+    'seconds': numpy.float64,
+    'heartRate': numpy.int16,
+    'accelerationX': numpy.float32,
+    'accelerationY': numpy.float32,
+    'accelerationZ': numpy.float32,
+    'angularVelocityX': numpy.float32,
+    'angularVelocityY': numpy.float32,
+    'angularVelocityZ': numpy.float32,
+    # float32 would lose about a meter of precision
+    'longitude': numpy.float64,
+    'latitude': numpy.float64,
+}
+'''Type of each known column; columns not listed here are stored as float32.'''
+MISSING_INT = -1
+'''Stored in integer columns where the CSV has no reading.'''
+
+_META_NAME = 'meta.json'
+_VERSION = 1
+_BLOCK_NUM_ROWS = 2**16
+
+def convert(csv_path: str, store_path: str = None, force=False) -> str:
+    '''
+    Converts the CSV at `csv_path` into a store at `store_path` (by default,
+    the CSV's path with a `.sensors` extension instead) and returns the path of
+    the store. Does nothing if the store is already up to date, unless `force`.
+    '''
+    store_path = store_path or path.splitext(csv_path)[0] + STORE_EXTENSION
+    source_stat = os.stat(csv_path)
+    if not force and _is_up_to_date(store_path, source_stat): return store_path
+    # Build the store aside and swap it in once complete, like retrieved files
+    part_path = store_path + '.part'
+    if path.exists(part_path): shutil.rmtree(part_path)
+    os.makedirs(part_path)
+    channels, blocks = read_csv_blocks(csv_path)
+    dtypes = tuple(numpy.dtype(CHANNEL_DTYPES.get(x, numpy.float32)) for x in channels)
+    targets = [open(path.join(part_path, x + '.bin'), 'wb') for x in channels]
+    try:
+        num_rows = 0
+        for block in blocks:
+            for column, dtype, target in zip(block.T, dtypes, targets):
+                if dtype.kind == 'i':
+                    column = numpy.where(numpy.isnan(column), MISSING_INT, column)
+                column.astype(dtype).tofile(target)
+            num_rows += len(block)
+    finally:
+        for target in targets: target.close()
+    with open(path.join(part_path, _META_NAME), 'w') as target:
+        json.dump(
+            {
+                'version': _VERSION,
+                'num_rows': num_rows,
+                'channels': channels,
+                'dtypes': [x.str for x in dtypes],
+                'source_size': source_stat.st_size,
+                'source_mtime': source_stat.st_mtime,
+            }, target)
+    if path.exists(store_path): shutil.rmtree(store_path)
+    os.replace(part_path, store_path)
+    return store_path
+
+def convert_dir(dir_path: str, force=False) -> list[str]:
+    '''
+    Converts every CSV in the directory at `dir_path`, such as the target
+    directory of `Retriever.retrieve_files`, and returns the paths of the
+    stores.
+    '''
+    return [
+        convert(path.join(dir_path, x), force=force)
+        for x in sorted(os.listdir(dir_path))
+        if x.lower().endswith('.csv')
+    ]
+
+def read_csv_blocks(csv_path: str, block_num_rows: int = _BLOCK_NUM_ROWS):
+    '''
+    Returns the channels (the header) of the CSV at `csv_path` and an iterator
+    over its rows in blocks of about `block_num_rows` rows, each a 2-D float64
+    array with NaN where a reading is missing.
+    '''
+    source = open(csv_path, encoding='utf-8')
+    channels = tuple(source.readline().strip().split(','))
+    
+    def blocks():
+        with source:
+            while True:
+                lines = source.readlines(block_num_rows * 64) # ~64 characters per row
+                if not lines: return
+                yield parse_rows(lines, len(channels))
+    
+    return channels, blocks()
+
+def parse_rows(lines: list[str], num_columns: int) -> numpy.ndarray:
+    '''
+    Parses CSV `lines` of `num_columns` numbers each into a 2-D float64 array,
+    with NaN where a reading is missing.
+    '''
+    try:
+        block = numpy.loadtxt(lines, delimiter=',', dtype=numpy.float64, ndmin=2)
+    except ValueError:
+        # Rows with empty or malformed fields; slower, but keeps them as NaN
+        block = numpy.genfromtxt(io.StringIO(''.join(lines)),
+                                 delimiter=',',
+                                 dtype=numpy.float64,
+                                 invalid_raise=False)
+        block = block.reshape(-1, num_columns)
+    if block.size == 0: return numpy.empty((0, num_columns))
+    if block.shape[1] != num_columns:
+        raise ValueError(f'Expected {num_columns} columns but found {block.shape[1]}')
+    return block
+
+class SensorStore:
+    '''
+    A store created by `convert`, opened for reading. Columns are memory-mapped
+    on first use, so only the parts that are read are ever loaded.
+    '''
+    
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        with open(path.join(store_path, _META_NAME)) as meta:
+            meta = json.load(meta)
+        if meta['version'] != _VERSION:
+            raise ValueError(f'Unsupported store version: {meta["version"]}')
+        self.num_rows: int = meta['num_rows']
+        self.channels: tuple[str] = tuple(meta['channels'])
+        self._dtypes = dict(zip(self.channels, map(numpy.dtype, meta['dtypes'])))
+        self._columns: dict[str, numpy.ndarray] = {}
+    
+    @property
+    def seconds(self) -> numpy.ndarray:
+        '''The time index: seconds since the recording started, in ascending order.'''
+        return self.get('seconds')
+    
+    def get(self, channel: str) -> numpy.ndarray:
+        '''Returns a whole column as a read-only, memory-mapped array.'''
+        if channel not in self._columns:
+            if channel not in self._dtypes: raise KeyError(f'No such channel: \'{channel}\'')
+            if self.num_rows == 0:
+                self._columns[channel] = numpy.empty(0, self._dtypes[channel])
+            else:
+                column_path = path.join(self.store_path, channel + '.bin')
+                self._columns[channel] = numpy.memmap(column_path,
+                                                      dtype=self._dtypes[channel],
+                                                      mode='r',
+                                                      shape=(self.num_rows,))
+        return self._columns[channel]
+    
+    def find(self, start_time: float = None, end_time: float = None) -> slice:
+        '''Returns the slice of rows recorded in [`start_time`, `end_time`).'''
+        seconds = self.seconds
+        start = 0 if start_time is None else int(numpy.searchsorted(seconds, start_time))
+        end = (self.num_rows
+               if end_time is None else int(numpy.searchsorted(seconds, end_time)))
+        return slice(start, max(start, end))
+    
+    def read(self, channel: str, start_time: float = None,
+             end_time: float = None) -> numpy.ndarray:
+        '''Returns the readings of `channel` recorded in [`start_time`, `end_time`).'''
+        return self.get(channel)[self.find(start_time, end_time)]
+    
+    def read_all(self, start_time: float = None, end_time: float = None,
+                 channels: tuple[str] = None) -> dict[str, numpy.ndarray]:
+        '''Returns the readings of several (by default, all) channels in a time range.'''
+        rows = self.find(start_time, end_time)
+        return {x: self.get(x)[rows] for x in channels or self.channels}
+    
+    def iter_blocks(self, block_num_rows: int = _BLOCK_NUM_ROWS, start_time: float = None,
+                    end_time: float = None, channels: tuple[str] = None):
+        '''
+        Iterates over the readings of several (by default, all) channels in a
+        time range, `block_num_rows` rows at a time, as dicts like `read_all`.
+        '''
+        rows = self.find(start_time, end_time)
+        for start in range(rows.start, rows.stop, block_num_rows):
+            block_rows = slice(start, min(start + block_num_rows, rows.stop))
+            yield {x: self.get(x)[block_rows] for x in channels or self.channels}
+
+def _is_up_to_date(store_path, source_stat):
+    try:
+        with open(path.join(store_path, _META_NAME)) as meta:
+            meta = json.load(meta)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('version') == _VERSION and meta['source_size'] == source_stat.st_size and
+            meta['source_mtime'] == source_stat.st_mtime)
+
+if __name__ == '__main__':
+    for source_path in sys.argv[1:]:
+        if path.isdir(source_path): print(*convert_dir(source_path), sep='\n')
+        else: print(convert(source_path))
@@ -0,0 +1,208 @@
+'''
+Cuts recorded sessions into paired windows of audio and sensor readings.
+
+A session is a WAV and a sensor CSV recorded together by a Tizen Sensor (named
+after the time it started, such as `21-07-05-15-27-00-Audio.wav` and
+`21-07-05-15-27-00-Sensor.csv`). `Session` memory-maps both lazily: the audio
+samples straight from the WAV, and the sensor readings from a `sensor_store`
+store that is made from the CSV on first use. `Session.iter_windows` yields
+sliding windows in batches of NumPy arrays, and `prefetch` has a pool of
+processes prepare batches ahead of the consumer, so that loading data keeps up
+with training on a many-core computer.
+'''
+
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+import os
+from os import path
+import random
+import recording_names
+import sensor_store
+import struct
+
+_SENSOR_RATE = 20 # Hz, the rate at which the watch writes rows
+_NUM_READY_BATCHES = 4
+
+_worker_sessions: dict[tuple, 'Session'] = {}
+'''Sessions opened by this (worker) process, so that each file is mapped only once.'''
+
+class Session:
+    '''
+    The audio at `audio_path` paired with the sensor readings at `sensor_path`
+    (a CSV, or a store made from it). Sensor readings are sampled at
+    `sensor_rate` points per second within each window, taking the last row
+    at or before each point.
+    '''
+    
+    def __init__(self, audio_path: str, sensor_path: str, sensor_rate: float = _SENSOR_RATE):
+        self.audio_path = audio_path
+        self.sensor_path = sensor_path
+        self.sensor_rate = sensor_rate
+        self._audio: numpy.ndarray = None
+        self._audio_rate: int = None
+        self._store: sensor_store.SensorStore = None
+    
+    def __reduce__(self):
+        # Only the paths are sent to other processes, which map the files themselves
+        return Session, (self.audio_path, self.sensor_path, self.sensor_rate)
+    
+    @property
+    def audio(self) -> numpy.ndarray:
+        '''The audio as a read-only, memory-mapped int16 array of (samples, channels).'''
+        if self._audio is None: self._audio, self._audio_rate = map_wav(self.audio_path)
+        return self._audio
+    
+    @property
+    def audio_rate(self) -> int:
+        if self._audio_rate is None: self._audio, self._audio_rate = map_wav(self.audio_path)
+        return self._audio_rate
+    
+    @property
+    def store(self) -> sensor_store.SensorStore:
+        if self._store is None:
+            store_path = self.sensor_path
+            if not path.isdir(store_path): store_path = sensor_store.convert(store_path)
+            self._store = sensor_store.SensorStore(store_path)
+        return self._store
+    
+    @property
+    def duration(self) -> float:
+        '''Seconds covered by both the audio and the sensor readings.'''
+        seconds = self.store.seconds
+        sensor_duration = float(seconds[-1]) if len(seconds) else 0.
+        return min(len(self.audio) / self.audio_rate, sensor_duration)
+    
+    def count_windows(self, window: float, hop: float) -> int:
+        '''Returns the number of windows of `window` seconds every `hop` seconds.'''
+        if self.duration < window: return 0
+        return int((self.duration - window) // hop) + 1
+    
+    def get_windows(self, start_times: numpy.ndarray, window: float,
+                    channels: tuple[str] = None) -> dict[str, numpy.ndarray]:
+        '''
+        Returns the windows of `window` seconds starting at `start_times` as a
+        batch: 'start_time' (batch), 'audio' (batch, samples, audio channels) in
+        int16 and 'sensors' (batch, points, channels) in float32, with NaN for
+        missing readings.
+        '''
+        start_times = numpy.asarray(start_times, numpy.float64)
+        channels = channels or tuple(x for x in self.store.channels if x != 'seconds')
+        # Audio: a strided view of the memory map, so only the windows are copied
+        num_samples = round(window * self.audio_rate)
+        starts = numpy.round(start_times * self.audio_rate).astype(numpy.int64)
+        starts = numpy.clip(starts, 0, max(0, len(self.audio) - num_samples))
+        windows = sliding_window_view(self.audio, num_samples, axis=0)
+        audio = numpy.ascontiguousarray(windows[starts].transpose(0, 2, 1))
+        # Sensors: the last row at or before each point of each window
+        num_points = round(window * self.sensor_rate)
+        times = start_times[:, None] + numpy.arange(num_points) / self.sensor_rate
+        rows = numpy.searchsorted(self.store.seconds, times, side='right') - 1
+        rows = numpy.clip(rows, 0, max(0, self.store.num_rows - 1))
+        sensors = numpy.empty((len(start_times), num_points, len(channels)), numpy.float32)
+        for i, channel in enumerate(channels):
+            column = self.store.get(channel)[rows]
+            if column.dtype.kind == 'i':
+                column = numpy.where(column == sensor_store.MISSING_INT, numpy.nan, column)
+            sensors[:, :, i] = column
+        return {'start_time': start_times, 'audio': audio, 'sensors': sensors}
+    
+    def iter_windows(self, window: float, hop: float, batch_size: int,
+                     channels: tuple[str] = None) -> Iterator[dict[str, numpy.ndarray]]:
+        '''Yields batches of `batch_size` (or fewer, at the end) sliding windows.'''
+        for start_times in _plan_batches(self.count_windows(window, hop), hop, batch_size):
+            yield self.get_windows(start_times, window, channels)
+
+def find_sessions(dir_path: str, sensor_rate: float = _SENSOR_RATE) -> list[Session]:
+    '''
+    Returns the sessions in the directory at `dir_path`: every WAV that has a
+    sensor CSV (or a store made from it) of the same recording.
+    '''
+    names = sorted(os.listdir(dir_path))
+    sensor_names = {}
+    for name in names:
+        extension = path.splitext(name)[1].lower()
+        if extension == sensor_store.STORE_EXTENSION:
+            sensor_names[recording_names.get_session_name(name)] = name
+        elif extension == '.csv':
+            sensor_names.setdefault(recording_names.get_session_name(name), name)
+    sessions = []
+    for name in names:
+        if path.splitext(name)[1].lower() != '.wav': continue
+        sensor_name = sensor_names.get(recording_names.get_session_name(name))
+        if sensor_name:
+            sessions.append(
+                Session(path.join(dir_path, name), path.join(dir_path, sensor_name),
+                        sensor_rate))
+    return sessions
+
+def prefetch(sessions: list[Session], window: float, hop: float, batch_size: int,
+             channels: tuple[str] = None, num_workers: int = None,
+             num_ready: int = _NUM_READY_BATCHES, shuffle=False,
+             seed: int = None) -> Iterator[dict[str, numpy.ndarray]]:
+    '''
+    Yields the batches of `Session.iter_windows` for all `sessions` (each batch
+    from a single session, with its index in 'session'), cut by a pool of
+    `num_workers` processes (by default, one per core) that keep `num_ready`
+    batches per process ready ahead of the consumer. With `shuffle`, the order
+    of the batches is shuffled.
+    '''
+    for session in sessions:
+        # Convert the CSVs once here rather than in every worker
+        session.store
+    tasks = [(i, start_times)
+             for i, session in enumerate(sessions)
+             for start_times in _plan_batches(session.count_windows(window, hop), hop,
+                                              batch_size)]
+    if shuffle: random.Random(seed).shuffle(tasks)
+    num_workers = num_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(num_workers) as executor:
+        pending = collections.deque()
+        for i, start_times in tasks:
+            pending.append(
+                executor.submit(_get_windows, sessions[i], i, start_times, window, channels))
+            if len(pending) >= num_workers * num_ready: yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def map_wav(audio_path: str) -> tuple[numpy.ndarray, int]:
+    '''
+    Returns the samples of the 16-bit WAV at `audio_path` as a read-only, memory-mapped
+    int16 array of (samples, channels), and the frame rate.
+    '''
+    # The wave module can't tell where the samples start, so walk the RIFF chunks here
+    with open(audio_path, 'rb') as audio:
+        riff, _, form = struct.unpack('<4sI4s', audio.read(12))
+        if riff != b'RIFF' or form != b'WAVE': raise ValueError(f'Not a WAV: \'{audio_path}\'')
+        num_channels = sample_width = frame_rate = None
+        while True:
+            header = audio.read(8)
+            if len(header) < 8: raise ValueError(f'No audio data: \'{audio_path}\'')
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = audio.read(chunk_size + chunk_size % 2)
+                _, num_channels, frame_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                sample_width = bits // 8
+            elif chunk_id == b'data':
+                offset = audio.tell()
+                break
+            else: audio.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    if sample_width != 2: raise ValueError('Only 16-bit audio is supported')
+    # Recorders that were cut off may leave the size of the data unset
+    data_size = min(chunk_size, path.getsize(audio_path) - offset)
+    num_frames = data_size // (num_channels * sample_width)
+    if num_frames == 0: return numpy.empty((0, num_channels), numpy.int16), frame_rate
+    return numpy.memmap(audio_path, '<i2', 'r', offset, (num_frames, num_channels)), frame_rate
+
+def _get_windows(session, session_index, start_times, window, channels):
+    key = (session.audio_path, session.sensor_path, session.sensor_rate)
+    session = _worker_sessions.setdefault(key, session)
+    batch = session.get_windows(start_times, window, channels)
+    batch['session'] = session_index
+    return batch
+
+def _plan_batches(num_windows, hop, batch_size):
+    for start in range(0, num_windows, batch_size):
+        yield numpy.arange(start, min(start + batch_size, num_windows)) * hop
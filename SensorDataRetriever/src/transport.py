@@ -0,0 +1,129 @@
+'''
+Adaptive HTTP transport used to talk to a Tizen Sensor.
+
+The watch reads a whole file into memory before it sends the first byte back,
+so the time a response takes grows with the size of the file. Instead of a
+fixed timeout, this module learns the latency and throughput of each watch and
+scales the timeout of every request to the number of bytes expected back.
+Retries are spaced out with jittered exponential backoff, and retry and timeout
+counts are kept per watch for reporting, along with the latency of every request
+in `metrics`.
+'''
+
+from http.client import HTTPResponse
+import metrics
+import random
+from threading import Lock
+import time
+from urllib import request as urllib_request
+
+PORT = 3456
+
+_MIN_TIMEOUT = 1 # s
+_MAX_TIMEOUT = 120 # s
+_LATENCY_FACTOR = 4
+'''Allow a response to take this many times the typical latency to arrive.'''
+_TRANSFER_FACTOR = 2
+'''Allow a transfer to take this many times its expected duration.'''
+_DEFAULT_LATENCY = .25 # s
+_DEFAULT_THROUGHPUT = 2**18 # bytes/s
+_SMOOTHING = .3
+'''Weight of the newest sample in the moving averages of latency and throughput.'''
+_BACKOFF_BASE = .25 # s
+_BACKOFF_CAP = 8 # s
+
+_lock = Lock()
+_stats: dict[str, dict] = {}
+
+def request(address: str, command: str, *args, expected_bytes: int = 0,
+            should_log=True) -> HTTPResponse:
+    '''
+    Sends a command to the watch at `address` and returns the response once its
+    header arrives.
+    
+    `expected_bytes` is the size of the response body if known (for example, from
+    the `size` command), which lengthens the timeout accordingly. Requests made many
+    times a second can leave `should_log` off.
+    '''
+    formatted_args = (len(args) > 0) * ':' + ','.join(map(str, args))
+    url = f'http://{address}:{PORT}/{command}{formatted_args}'
+    timeout = get_timeout(address, expected_bytes)
+    if should_log: print('Open:', url, f'({timeout:.1f}s)')
+    start_time = time.monotonic()
+    try:
+        response = urllib_request.urlopen(url, timeout=timeout)
+    except Exception:
+        metrics.count('retriever_request_errors_total', address=address, command=command)
+        raise
+    latency = time.monotonic() - start_time
+    metrics.observe('retriever_request_seconds', latency, address=address, command=command)
+    if should_log:
+        metrics.log('request', address=address, command=command, args=list(map(str, args)),
+                    seconds=round(latency, 4), timeout=round(timeout, 2))
+    if not expected_bytes:
+        # Only small responses say anything about the latency; large ones are dominated by
+        # the watch reading the file
+        _update(address, 'latency', latency)
+    return response
+
+def get_timeout(address: str, expected_bytes: int = 0) -> float:
+    '''Returns the timeout in seconds for a response of `expected_bytes` bytes.'''
+    stats = _get_stats(address)
+    timeout = (_LATENCY_FACTOR * stats['latency'] +
+               _TRANSFER_FACTOR * expected_bytes / stats['throughput'])
+    return min(max(timeout, _MIN_TIMEOUT), _MAX_TIMEOUT)
+
+def record_transfer(address: str, num_bytes: int, seconds: float):
+    '''Records that `num_bytes` bytes took `seconds` seconds to request and receive.'''
+    if num_bytes > 0 and seconds > 0: _update(address, 'throughput', num_bytes / seconds)
+
+def record_failure(address: str, ex: Exception):
+    '''
+    Records a failed request. Timeouts also halve the estimated throughput so
+    that the next attempt waits longer.
+    '''
+    if not _is_timeout(ex): return
+    metrics.count('retriever_timeouts_total', address=address)
+    stats = _get_stats(address)
+    with _lock:
+        stats['timeouts'] += 1
+        stats['throughput'] /= 2
+
+def back_off(address: str, attempt: int):
+    '''
+    Blocks the thread before retrying for the `attempt`-th time (the first
+    attempt, 0, does not wait).
+    '''
+    if attempt == 0: return
+    stats = _get_stats(address)
+    with _lock: stats['retries'] += 1
+    metrics.count('retriever_retries_total', address=address)
+    delay = min(_BACKOFF_BASE * 2**(attempt - 1), _BACKOFF_CAP)
+    time.sleep(delay * random.uniform(.5, 1.5))
+
+def get_stats(address: str) -> dict:
+    '''
+    Returns the estimated latency (s) and throughput (bytes/s) along with the
+    retry and timeout counts of the watch at `address`.
+    '''
+    stats = _get_stats(address)
+    with _lock: return dict(stats)
+
+def _get_stats(address):
+    with _lock:
+        if address not in _stats:
+            _stats[address] = {
+                'latency': _DEFAULT_LATENCY,
+                'throughput': _DEFAULT_THROUGHPUT,
+                'retries': 0,
+                'timeouts': 0,
+            }
+        return _stats[address]
+
+def _update(address, key, sample):
+    stats = _get_stats(address)
+    with _lock: stats[key] += _SMOOTHING * (sample - stats[key])
+
+def _is_timeout(ex):
+    # urlopen wraps timeouts that happen while connecting in a URLError
+    return isinstance(ex, TimeoutError) or isinstance(getattr(ex, 'reason', None), TimeoutError)
@@ -1,6 +1,7 @@
 ﻿using System;
 using System.Collections.Generic;
 using System.Diagnostics;
+using System.Globalization;
 using System.IO;
 using System.Linq;
 using System.Threading;
@@ -35,6 +36,8 @@ namespace TizenSensor.lib
 
 		protected const double SensorUpdateInterval = .05;
 
+		protected const int LiveRowCapacity = 1200; // a minute of rows
+
 		protected static readonly string DataHeader = "seconds," + string.Join(',', Enum.GetNames(typeof(Stat))
 			.Select(name => char.ToLower(name[0]) + name.Substring(1)));
 
@@ -89,6 +92,9 @@ namespace TizenSensor.lib
 
 		protected SensorBuffer buffer = new SensorBuffer();
 
+		/// <summary>The latest rows (with their seconds) for streaming, oldest first.</summary>
+		protected Queue<(double, string)> liveRows = new Queue<(double, string)>(LiveRowCapacity);
+
 		public void Start(string recordFilePath)
 		{
 			if (IsRunning) return;
@@ -117,6 +123,18 @@ namespace TizenSensor.lib
 				lock (buffer) buffer.WriteCsv(dataWriter, RunningTime - 30);
 				return IsRunning;
 			});
+			Device.StartTimer(TimeSpan.FromSeconds(SensorUpdateInterval), () =>
+			{
+				double seconds = RunningTime;
+				string row;
+				lock (buffer) row = buffer.GetLatestCsvRow(seconds);
+				lock (liveRows)
+				{
+					if (liveRows.Count == LiveRowCapacity) liveRows.Dequeue();
+					liveRows.Enqueue((seconds, row));
+				}
+				return IsRunning;
+			});
 		}
 
 		public void Stop()
@@ -127,36 +145,63 @@ namespace TizenSensor.lib
 			accelerometer.Stop();
 			gyroscope.Stop();
 			locator.Stop();
-			lock (buffer) buffer.WriteCsv(dataWriter, RunningTime);
-			buffer.Clear();
+			lock (buffer)
+			{
+				buffer.WriteCsv(dataWriter, RunningTime);
+				buffer.Clear();
+			}
+			lock (liveRows) liveRows.Clear();
 			dataWriter?.Dispose();
 			dataWriter = null;
 		}
 
+		/// <summary>
+		/// Returns the rows of the last minute recorded after <c>since</c> seconds, formatted as CSV with a header.
+		/// </summary>
+		public string GetLiveCsv(double since)
+		{
+			if (!IsRunning) throw new InvalidOperationException("Not recording");
+
+			lock (liveRows)
+			{
+				var rows = liveRows.Where(row => row.Item1 > since).Select(row => row.Item2);
+				return DataHeader + '\n' + string.Join("\n", rows);
+			}
+		}
+
 		protected void HandleHeartRateMonitorDataUpdated(object sender, HeartRateMonitorDataUpdatedEventArgs e)
 		{
-			buffer.Add(Stat.HeartRate, RunningTime, e.HeartRate);
+			lock (buffer) buffer.Add(Stat.HeartRate, RunningTime, e.HeartRate);
 		}
 
 		protected void HandleAccelerometerDataUpdated(object sender, AccelerometerDataUpdatedEventArgs e)
 		{
-			buffer.Add(Stat.AccelerationX, RunningTime, e.X);
-			buffer.Add(Stat.AccelerationY, RunningTime, e.Y);
-			buffer.Add(Stat.AccelerationZ, RunningTime, e.Z);
+			lock (buffer)
+			{
+				buffer.Add(Stat.AccelerationX, RunningTime, e.X);
+				buffer.Add(Stat.AccelerationY, RunningTime, e.Y);
+				buffer.Add(Stat.AccelerationZ, RunningTime, e.Z);
+			}
 		}
 
 		protected void HandleGyroscopeDataUpdated(object sender, GyroscopeDataUpdatedEventArgs e)
 		{
-			buffer.Add(Stat.AngularVelocityX, RunningTime, e.X);
-			buffer.Add(Stat.AngularVelocityY, RunningTime, e.Y);
-			buffer.Add(Stat.AngularVelocityZ, RunningTime, e.Z);
+			lock (buffer)
+			{
+				buffer.Add(Stat.AngularVelocityX, RunningTime, e.X);
+				buffer.Add(Stat.AngularVelocityY, RunningTime, e.Y);
+				buffer.Add(Stat.AngularVelocityZ, RunningTime, e.Z);
+			}
 		}
 
 		protected void HandleLocatorDistanceBasedLocationChanged(object sender, LocationChangedEventArgs e)
 		{
 			double measureTime = (e.Location.Timestamp - recordStartTime).TotalSeconds;
-			buffer.Add(Stat.Longitude, measureTime, e.Location.Longitude);
-			buffer.Add(Stat.Latitude, measureTime, e.Location.Latitude);
+			lock (buffer)
+			{
+				buffer.Add(Stat.Longitude, measureTime, e.Location.Longitude);
+				buffer.Add(Stat.Latitude, measureTime, e.Location.Latitude);
+			}
 		}
 
 		protected class SensorBuffer
@@ -172,6 +217,8 @@ namespace TizenSensor.lib
 
 			protected Dictionary<Stat, double> history = new Dictionary<Stat, double>(Stats.Count);
 
+			protected double[] latest = new double[Stats.Count];
+
 			protected Dictionary<Stat, SortedDictionary<double, double>> buffer =
 				new Dictionary<Stat, SortedDictionary<double, double>>(Stats.Count);
 
@@ -180,6 +227,7 @@ namespace TizenSensor.lib
 			public void Add(Stat stat, double measureTime, double value)
 			{
 				buffer[stat][measureTime] = value;
+				latest[(int)stat] = value;
 			}
 
 			public void Clear()
@@ -189,9 +237,20 @@ namespace TizenSensor.lib
 					history[stat] = 0;
 					buffer[stat].Clear();
 				}
+				Array.Clear(latest, 0, latest.Length);
 				lastWriteTime = -SensorUpdateInterval;
 			}
 
+			/// <summary>
+			/// Formats the latest reading of every stat as a CSV row at <c>seconds</c>, with a period as the decimal
+			/// separator whatever the watch's language.
+			/// </summary>
+			public string GetLatestCsvRow(double seconds)
+			{
+				var values = Stats.Select(stat => latest[(int)stat].ToString(CultureInfo.InvariantCulture));
+				return seconds.ToString(CultureInfo.InvariantCulture) + ',' + string.Join(',', values);
+			}
+
 			/// <summary>Writes buffered data formatted as CSV up to <c>timeLimit</c> and clears.</summary>
 			public void WriteCsv(StreamWriter writer, double timeLimit)
 			{
@@ -1,6 +1,7 @@
 ﻿using NetworkUtil;
 
 using System;
+using System.Globalization;
 using System.IO;
 using System.Linq;
 using System.Net.Sockets;
@@ -66,7 +67,9 @@ namespace TizenSensor.lib
 						break;
 
 					case "retrieve":
-						byte[] content = File.ReadAllBytes(Path.Combine(RecordDirectoryPath, args[0]));
+						// An optional offset lets the retriever resume a partially retrieved file
+						long offset = args.Length == 2 ? long.Parse(args[1]) : 0;
+						byte[] content = ReadFile(Path.Combine(RecordDirectoryPath, args[0]), offset);
 						Networking.SendAndClose(target, Encoding.UTF8.GetBytes(HttpOkHeader), content);
 						break;
 
@@ -75,16 +78,11 @@ namespace TizenSensor.lib
 						Networking.SendAndClose(target, HttpOkHeader + '1');
 						break;
 
-					//case "stream":
-					//	try
-					//	{
-					//		Networking.SendAndClose(target, HttpOkHeader + string.Join("\n", Sensor.GetData(int.Parse(args[0]))));
-					//	}
-					//	catch
-					//	{
-					//		Networking.SendAndClose(target, HttpOkHeader + "-1");
-					//	}
-					//	break;
+					case "stream":
+						// The rows recorded after the given seconds, as far back as a minute
+						double since = args.Length == 1 ? double.Parse(args[0], CultureInfo.InvariantCulture) : -1;
+						Networking.SendAndClose(target, HttpOkHeader + Sensor.GetLiveCsv(since));
+						break;
 
 					default:
 						throw new ArgumentException("Unknown command: " + command);
@@ -96,5 +94,27 @@ namespace TizenSensor.lib
 				Networking.SendAndClose(target, HttpBadHeader + ex.Message);
 			}
 		}
+
+		/// <summary>
+		/// Reads the file at <c>path</c> from <c>offset</c> bytes in to its end, without loading the part before.
+		/// </summary>
+		private static byte[] ReadFile(string path, long offset)
+		{
+			using (var file = new FileStream(path, FileMode.Open, FileAccess.Read))
+			{
+				offset = Math.Min(offset, file.Length);
+				file.Seek(offset, SeekOrigin.Begin);
+				byte[] content = new byte[file.Length - offset];
+				int numBytesRead = 0;
+				while (numBytesRead < content.Length)
+				{
+					int count = file.Read(content, numBytesRead, content.Length - numBytesRead);
+					if (count == 0) break;
+					numBytesRead += count;
+				}
+				if (numBytesRead < content.Length) Array.Resize(ref content, numBytesRead);
+				return content;
+			}
+		}
 	}
 }